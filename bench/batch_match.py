@@ -0,0 +1,59 @@
+"""
+Finds the crossover between the per-IP index lookup, the legacy set
+intersection and the NumPy batch matcher for growing query batches.
+
+Usage: python bench/batch_match.py [feeds] [ips_per_feed]
+"""
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import batchmatch, blindex  # noqa: E402
+
+
+def timed(func):
+    start = time.perf_counter()
+    hits = func()
+    return (time.perf_counter() - start) * 1000, hits
+
+
+def main():
+    if not batchmatch.available():
+        sys.exit("NumPy is required for this benchmark")
+
+    feed_cnt = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    ip_cnt = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    rnd = random.Random(1)
+    data = {f"feed {n}": {rnd.getrandbits(32) for _ in range(ip_cnt)} for n in range(feed_cnt)}
+    listed = [ip for ips in data.values() for ip in ips]
+    str_data = {name: [blindex.int_to_ip(ip) for ip in ips] for name, ips in data.items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        idx_path = Path(tmp, "blacklist.idx")
+        blindex.build(idx_path, {name: [(ip, ip) for ip in ips] for name, ips in data.items()})
+
+        print(f"{feed_cnt} feeds x {ip_cnt:,} IPs (ms, matcher build included)")
+        print(f"{'queries':>9} {'set &':>10} {'lookup':>10} {'numpy':>10}")
+        with blindex.BlacklistIndex(idx_path) as index:
+            for size in (10, 100, 1_000, 2_000, 5_000, 10_000, 100_000):
+                values = list({rnd.choice(listed) if n % 10 == 0 else rnd.getrandbits(32) for n in range(size)})
+                queries = [blindex.int_to_ip(value) for value in values]
+
+                set_ms, set_hits = timed(lambda: sum(len(set(queries) & set(item)) for item in str_data.values()))
+                lookup_ms, lookup_hits = timed(lambda: sum(len(index.lookup(value)) for value in values))
+
+                def numpy_match():
+                    matcher = batchmatch.BatchMatcher.from_index(index)
+                    return int(matcher.match(values).sum())
+
+                numpy_ms, numpy_hits = timed(numpy_match)
+                assert set_hits == lookup_hits == numpy_hits
+                print(f"{size:>9,} {set_ms:>10.2f} {lookup_ms:>10.2f} {numpy_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compares load time, lookup time and peak RSS of the legacy indent=4 JSON
+blacklist against the memory-mapped binary index.
+
+Usage: python bench/index_load.py [feeds] [ips_per_feed]
+"""
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import blindex  # noqa: E402
+
+
+def make_data(feed_cnt, ip_cnt):
+    rnd = random.Random(1)
+    return {f"feed {n}": {rnd.getrandbits(32) for _ in range(ip_cnt)} for n in range(feed_cnt)}
+
+
+def run_json(path, queries):
+    start = time.perf_counter()
+    with open(path) as json_file:
+        data = json.load(json_file)["Blacklists"]
+    loaded = time.perf_counter()
+    hits = sum(1 for item in data.values() for ip in set(queries) & set(item))
+    return loaded - start, time.perf_counter() - loaded, hits
+
+
+def run_index(path, queries):
+    start = time.perf_counter()
+    index = blindex.BlacklistIndex(path)
+    loaded = time.perf_counter()
+    values = [blindex.ip_to_int(ip) for ip in queries]
+    hits = sum(len(index.lookup(value)) for value in values)
+    return loaded - start, time.perf_counter() - loaded, hits
+
+
+def peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so prefer the per-process high water mark
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode, path, queries):
+    load, lookup, hits = (run_json if mode == "json" else run_index)(path, queries)
+    rss = peak_rss_kb()
+    print(json.dumps({"load": load, "lookup": lookup, "hits": hits, "rss_kb": rss}))
+
+
+def main():
+    feed_cnt = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    ip_cnt = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    data = make_data(feed_cnt, ip_cnt)
+    queries = [blindex.int_to_ip(next(iter(ips))) for ips in data.values()][:10]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp, "blacklist.json")
+        idx_path = Path(tmp, "blacklist.idx")
+        with open(json_path, "w") as json_file:
+            bl_dict = {"Blacklists": {k: [blindex.int_to_ip(v) for v in ips] for k, ips in data.items()}}
+            json.dump(bl_dict, json_file, ensure_ascii=False, indent=4)
+        blindex.build(idx_path, {name: [(ip, ip) for ip in ips] for name, ips in data.items()})
+
+        print(f"{feed_cnt} feeds x {ip_cnt:,} IPs")
+        for mode, path in (("json", json_path), ("index", idx_path)):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, str(path), *queries], capture_output=True, text=True, check=True
+            )
+            res = json.loads(out.stdout)
+            print(
+                f"{mode:6} size {path.stat().st_size / 1e6:7.2f} MB  load {res['load'] * 1000:8.2f} ms  "
+                f"lookup {res['lookup'] * 1000:8.2f} ms  hits {res['hits']}  max rss {res['rss_kb'] / 1024:7.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        main()
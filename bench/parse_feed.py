@@ -0,0 +1,68 @@
+"""
+Compares the parse throughput (MB/s) of each feed format parser with the
+generic regex parser, on synthetic feeds in each format.
+
+Usage: python bench/parse_feed.py [lines_per_feed]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import blindex, feedparsers  # noqa: E402
+
+
+def random_ip(rnd):
+    return blindex.int_to_ip(rnd.randrange(1 << 24, 0xDFFFFFFF))
+
+
+def sample_feeds(rnd, count):
+    """ Returns (format, options, text) for a synthetic feed of each format """
+    ips = [random_ip(rnd) for _ in range(count)]
+    rules = [
+        f'alert tcp [{",".join(ips[i:i + 20])}] any -> $HOME_NET any (msg:"ET TOR Known Tor Relay group {i}"; '
+        f"classtype:misc-attack; sid:{2520000 + i}; rev:4250;)"
+        for i in range(0, count, 20)
+    ]
+    return [
+        ("plain", {}, "# generated list\n" + "\n".join(f"{ip}\t# 2021-01-01 12:00:00" for ip in ips)),
+        ("ipset", {}, "#\n# ipset v1.2.3 generated\n#\n" + "\n".join(ips)),
+        (
+            "csv",
+            {"column": 2},
+            "first_seen,last_seen,ip_address,category,attacks_count\n"
+            + "\n".join(f"2021-01-01 10:00:00,2021-01-02 11:00:00,{ip},12,{n}" for n, ip in enumerate(ips)),
+        ),
+        ("snort", {}, "# Emerging Threats rules\n" + "\n".join(rules)),
+        ("alienvault", {}, "\n".join(f"{ip}#4#2#Malicious Host#US#Mountain View#37.4,-122.0#3" for ip in ips)),
+    ]
+
+
+def throughput(text, fmt, options):
+    """ Returns the MB/s and interval count of the best of three runs """
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        intervals = feedparsers.parse(text.splitlines(), fmt, **options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(text) / best / 1e6, len(intervals)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    rnd = random.Random(1)
+
+    print(f"{'format':12}{'size':>9}{'format MB/s':>13}{'regex MB/s':>12}{'speedup':>9}{'IPs':>10}{'regex IPs':>11}")
+    for fmt, options, text in sample_feeds(rnd, count):
+        fast, found = throughput(text, fmt, options)
+        slow, regex_found = throughput(text, "regex", {})
+        print(
+            f"{fmt:12}{len(text) / 1e6:>7.1f}MB{fast:>13.1f}{slow:>12.1f}{fast / slow:>8.1f}x{found:>10,}{regex_found:>11,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,27 @@
 import argparse
+import atexit
+import contextlib
+import json
 import os
 import sys
-import urllib.error
-import urllib.request
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from ipaddress import IPv4Address
+from ipaddress import ip_address
 from pathlib import Path
 
-import requests
-import urllib3
+from colorama import init
 
-from utils.blworker import ProcessBL
-from utils.dnsblworker import DNSBL
+from utils import blindex, records
+from utils.atomicfile import atomic_open
+from utils.blworker import ProcessBL, enrich_db, feed_db
+from utils.enrichcache import DEFAULT_TTLS, EnrichCache
+from utils.errors import CheckError
+from utils.intelclient import IntelClient
+from utils.ratelimit import DEFAULT_LIMITS, Quota
 from utils.termcolors import Termcolor as Tc
-from utils.vtworker import VirusTotal
-from utils.aipdbworker import AbuseIPDB
 
 __author__ = "DFIRSec (@pulsecode)"
 __version__ = "v0.1.5"
@@ -25,14 +31,13 @@ __description__ = "Check IP addresses against blacklists from various sources."
 # suppress dnspython feature deprecation warning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-# suppress certificate verification
-urllib3.disable_warnings()
-
 # Base directory paths
 parent = Path(__file__).resolve().parent
-blklist = parent.joinpath("resc/blacklist.json")
+blklist = parent.joinpath("resc/blacklist.idx")
 feeds = parent.joinpath("resc/feeds.json")
 settings = parent.joinpath("settings.cfg")
+quota_file = parent.joinpath("resc/intel_quota.json")
+release_file = parent.joinpath("resc/release_check.json")
 
 
 def parser():
@@ -47,15 +52,49 @@ def parser():
         type=int,
         metavar="threads",
         default=25,
-        help="threads for rbl check (default 25, max 50)",
+        help="threads for ip lookups (default 25, max 50)",
     )
     
     p.add_argument("-v", dest="vt_query", action="store_true", help="check virustotal for ip info")
     p.add_argument("-a", dest="aipdb_query", action="store_true", help="check abuseipdb for ip info")
+    p.add_argument(
+        "-d",
+        dest="dnsbl",
+        action="store_true",
+        help="check multiple ips (-q or -f) against the rbls",
+    )
+    p.add_argument(
+        "-b",
+        dest="bulk",
+        action="store_true",
+        help="stream listed ips from file (-f) to stdout, without ip lookups",
+    )
+    p.add_argument(
+        "-o",
+        dest="output",
+        choices=("text", "ndjson", "csv"),
+        default="text",
+        help="output format for -q / -f results, ndjson and csv stream one record per ip (default text)",
+    )
 
     group1.add_argument("-u", dest="update", action="store_true", help="update blacklist feeds")
     group1.add_argument("-fu", dest="force", action="store_true", help="force update of all feeds")
     group1.add_argument("-s", dest="show", action="store_true", help="show blacklist feeds")
+    group1.add_argument("-z", dest="zones", action="store_true", help="show failing rbl zones")
+    group1.add_argument(
+        "-w",
+        dest="watch",
+        action="store_true",
+        help="keep feeds refreshed in the foreground, each on its own interval",
+    )
+    group1.add_argument(
+        "-srv",
+        dest="serve",
+        nargs="?",
+        const="",
+        metavar="addr",
+        help="serve json lookups on host:port or a unix socket path (default from settings.cfg)",
+    )
     
     group2.add_argument(
         "-q",
@@ -66,6 +105,13 @@ def parser():
     )
 
     group2.add_argument("-f", dest="file", metavar="file", help="query a list of ip addresses from file")
+    group2.add_argument(
+        "-hist",
+        dest="history",
+        nargs="+",
+        metavar="ip",
+        help="show when each feed first and last listed the ips (requires 'store' in settings.cfg)",
+    )
     group2.add_argument("-i", dest="insert", action="store_true", help="insert a new blacklist feed")
     group2.add_argument(
         "-r",
@@ -77,89 +123,361 @@ def parser():
     return p
 
 
+def dnsbl_engine(config):
+    """ Returns the DNSBL engine, importing dnspython only for the options that query the RBLs """
+    from utils.dnsblworker import DNSBL
+
+    nameservers = config.get("dnsbl", "nameservers", fallback="").split()
+    return DNSBL(
+        concurrency=config.getint("dnsbl", "concurrency", fallback=100),
+        timeout=config.getfloat("dnsbl", "timeout", fallback=3),
+        nameservers=nameservers or None,
+        port=config.getint("dnsbl", "port", fallback=53),
+    )
+
+
+def intel_batch(hosts, batches):
+    """ Runs each provider batch in its own thread and prints results as they arrive """
+    hosts = list(dict.fromkeys(hosts))
+
+    def worker(title, batch):
+        try:
+            for ip, summary in batch(hosts):
+                if summary is None:
+                    print(f"{title:12} {ip:16} {Tc.error}{Tc.dl_error}{Tc.rst}")
+                else:
+                    print(f"{title:12} {ip:16} {summary}")
+        except CheckError as err:
+            # e.g. an invalid api key, stops this provider only
+            print(f"{title:12} {Tc.error} {err}")
+
+    threads = [threading.Thread(target=worker, args=item, daemon=True) for item in batches]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        sys.exit(f"\n{Tc.warning} Interrupted, finished lookups are cached -- rerun to resume")
+
+
+def write_records(pbl, ip_addrs, writer, enrich=True, chunk_size=1000, dnsbl=None, lookups=(), prefilter=False):
+    """ Writes a result record per IP, each as soon as its checks complete """
+    for chunk in pbl.check_chunks(ip_addrs, enrich=enrich, chunk_size=chunk_size, prefilter=prefilter):
+        valid = [record for record in chunk if "error" not in record]
+        listed = dnsbl.dnsbl_check([record["ip"] for record in valid]) if dnsbl and valid else {}
+        for record in chunk:
+            if "error" not in record:
+                if dnsbl:
+                    record["dnsbl"] = listed.get(record["ip"], {})
+                for field, lookup in lookups:
+                    record[field] = lookup(record["ip"])
+            writer.write(record)
+            if lookups:
+                # provider lookups are paced, so each record is flushed as it completes
+                writer.flush()
+        writer.flush()
+
+
+def refresh_release(cached):
+    """ Fetches the latest release tag into the release cache """
+    import requests
+
+    # record the attempt first, so an interrupted check is not retried on every run
+    cached["checked"] = time.time()
+    with atomic_open(release_file) as f:
+        json.dump(cached, f)
+    try:
+        url = f"https://api.github.com/repos/dfirsec/{parent.stem}/releases/latest"
+        cached["latest"] = requests.get(url, timeout=5).json()["tag_name"]
+    except Exception:
+        return
+    with atomic_open(release_file) as f:
+        json.dump(cached, f)
+
+
+def release_check():
+    """ Prints a notice for a newer cached release, refreshing the cache in the background once a day """
+    try:
+        with open(release_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+
+    latest = cached.get("latest")
+    if latest and latest != __version__:
+        print(f"{Tc.yellow}* Release {latest} of {parent.stem} is available{Tc.rst}")
+    if time.time() - cached.get("checked", 0) > 86400:
+        threading.Thread(target=refresh_release, args=(cached,), daemon=True).start()
+
+
+def print_banner():
+    banner = fr"""
+        ____  __           __   ___      __     ________              __  
+       / __ )/ /___ ______/ /__/ (_)____/ /_   / ____/ /_  ___  _____/ /__
+      / __  / / __ `/ ___/ //_/ / / ___/ __/  / /   / __ \/ _ \/ ___/ //_/
+     / /_/ / / /_/ / /__/ ,< / / (__  ) /_   / /___/ / / /  __/ /__/ ,<   
+    /_____/_/\__,_/\___/_/|_/_/_/____/\__/   \____/_/ /_/\___/\___/_/|_|
+                                                                {__version__}
+    """
+
+    print(f"{Tc.cyan}{banner}{Tc.rst}")
+
+
 def main():
     p = parser()
     args = p.parse_args()
+    init(autoreset=True)
+
+    # with a structured output or -b, stdout carries only the records and everything else goes to stderr
+    writer = None
+    out = sys.stdout
+    if args.output != "text" or (args.bulk and args.file):
+        # the raw stream, records skip colorama's ansi conversion on every write
+        out = sys.__stdout__
+        sys.stdout = sys.stderr
+    if args.output != "text":
+        writer = records.writer(args.output, out)
 
-    pbl = ProcessBL()
-    dbl = DNSBL(host=args.query, threads=args.threads)
+    print_banner()
+
+    # check if new version is available
+    release_check()
+
+    # ---[ Configuration Parser ]---
+    config = ConfigParser()
+    config.read(settings)
+
+    # ip lookup cache, ttls are configured in hours
+    cache = EnrichCache(
+        enrich_db,
+        ttls={
+            source: config.getfloat("cache", f"{source}_ttl", fallback=default / 3600) * 3600
+            for source, default in DEFAULT_TTLS.items()
+        },
+        max_entries=config.getint("cache", "max_entries", fallback=50000),
+    )
+    # writes the batched cache updates, also when a run is interrupted
+    atexit.register(cache.close)
+
+    # one keep-alive session per intel provider, shared by all lookups
+    intel = IntelClient()
+
+    # optional history of the feed contents
+    store = None
+    if config.getboolean("feeds", "store", fallback=False):
+        from utils.feedstore import FeedStore
+
+        store = FeedStore(feed_db)
+
+    pbl = ProcessBL(
+        concurrency=config.getint("feeds", "concurrency", fallback=16),
+        timeout=config.getfloat("feeds", "timeout", fallback=30),
+        cache=cache,
+        workers=args.threads,
+        intel=intel,
+        interval=config.getfloat("feeds", "interval", fallback=24) * 3600,
+        store=store,
+        fp_rate=config.getfloat("feeds", "bloom_fp_rate", fallback=0.01),
+    )
 
     # check arguments
     if len(sys.argv[1:]) == 0:
         p.print_help()
         p.exit()
 
+    # ---[ Intel Providers ]---
+    virustotal = abuseipdb = None
+    if args.vt_query:
+        from utils.vtworker import VirusTotal
+
+        # verify api key
+        if not config.get("virustotal", "api_key"):
+            sys.exit("Please add VT API key to the 'settings.cfg' file")
+        virustotal = VirusTotal(config.get("virustotal", "api_key"), intel=intel)
+    if args.aipdb_query:
+        from utils.aipdbworker import AbuseIPDB
+
+        # verify api key
+        if not config.get("abuseipdb", "api_key"):
+            sys.exit("Please add AbuseIPDB API key to the 'settings.cfg' file")
+        abuseipdb = AbuseIPDB(config.get("abuseipdb", "api_key"), intel=intel)
+
+    # provider quotas, shared by runs through the saved bucket levels
+    quota = Quota(quota_file)
+    for provider, (per_minute, per_day) in DEFAULT_LIMITS.items():
+        quota.limit(provider, config.getint(provider, "requests_per_minute", fallback=per_minute), 60)
+        quota.limit(provider, config.getint(provider, "requests_per_day", fallback=per_day), 86400)
+    batches = []
+    if virustotal:
+        batches.append(("VirusTotal", lambda hosts: virustotal.vt_batch(hosts, cache, quota)))
+    if abuseipdb:
+        batches.append(("AbuseIPDB", lambda hosts: abuseipdb.aipdb_batch(hosts, cache, quota)))
+
     if not blklist.exists() or os.stat(blklist).st_size == 0:
         print(f"{Tc.yellow}Blacklist file is missing...{Tc.rst}\n")
         pbl.update_list()
 
-    if args.query:
+    if writer and (args.query or args.file):
+        if args.file and pbl.outdated():
+            print(Tc.outdated, file=sys.stderr)
+        if args.query:
+            # invalid ips are written as error records
+            infile = contextlib.nullcontext(arg.replace(",", "") for arg in args.query)
+        else:
+            try:
+                infile = open(args.file)
+            except FileNotFoundError:
+                sys.exit(f"{Tc.warning} No such file: {args.file}")
+        single = args.query is not None and len(args.query) == 1
+
+        lookups = []
+        if single:
+            lookups += [("ip46", pbl.ip46_report), ("urlhaus", pbl.urlhaus_report)]
+        if virustotal:
+            lookups.append(
+                ("virustotal", lambda ip: virustotal.vt_record(virustotal.vt_cached(ip, cache, quota)))
+            )
+        if abuseipdb:
+            lookups.append(
+                ("abuseipdb", lambda ip: abuseipdb.aipdb_record(abuseipdb.aipdb_cached(ip, cache, quota)))
+            )
+
+        with infile as lines:
+            write_records(
+                pbl,
+                lines if args.query else pbl.read_ips(lines),
+                writer,
+                enrich=not args.bulk,
+                chunk_size=10000 if args.bulk else 1000,
+                dnsbl=dnsbl_engine(config) if args.dnsbl or single else None,
+                lookups=lookups,
+                prefilter=args.bulk,
+            )
+
+    elif args.query:
         ip_addrs = []
         for arg in args.query:
             try:
-                IPv4Address(arg.replace(",", ""))
+                ip_address(arg.replace(",", ""))
                 ip_addrs.append(arg.replace(",", ""))
             except ValueError:
                 sys.exit(f"{Tc.warning} {'INVALID IP':12} {arg}")
 
         pbl.ip_matches(ip_addrs)
 
-        # single ip check
-        if len(args.query) == 1:
+        if len(ip_addrs) > 1 and args.dnsbl:
             print(f"\n{Tc.dotsep}\n{Tc.green}[ Reputation Block List Check ]{Tc.rst}")
-            dbl.dnsbl_mapper(args.threads)
-
-            print(f"\n{Tc.dotsep}\n{Tc.green}[ IP-46 IP Intel Check ]{Tc.rst}")
-            pbl.ip46_qry(args.query)
-
-            print(f"\n{Tc.dotsep}\n{Tc.green}[ URLhaus Check ]{Tc.rst}")
-            pbl.urlhaus_qry(args.query)
-            
-            # ---[ Configuration Parser ]---
-            config = ConfigParser()
-            config.read(settings)
+            dnsbl_engine(config).dnsbl_mapper(ip_addrs)
 
-            # VirusTotal Query
-            if args.vt_query:
-                print(f"\n{Tc.dotsep}\n{Tc.green}[ VirusTotal Check ]{Tc.rst}")
+        if len(ip_addrs) > 1 and batches:
+            print(f"\n{Tc.dotsep}\n{Tc.green}[ Intel Batch Check ]{Tc.rst}")
+            intel_batch(ip_addrs, batches)
 
-                # verify api key
-                if not config.get("virustotal", "api_key"):
-                    sys.exit("Please add VT API key to the 'settings.cfg' file")
-                else:
-                    api_key = config.get("virustotal", "api_key")
-                    virustotal = VirusTotal(api_key)
-                    virustotal.vt_run(ip_addrs)
-            
-            # AbuseIPDB
-            if args.aipdb_query:
-                print(f"\n{Tc.dotsep}\n{Tc.green}[ AbuseIPDB Check ]{Tc.rst}")
-                
-                # verify api key
-                if not config.get("abuseipdb", "api_key"):
-                    sys.exit("Please add AbuseIPDB API key to the 'settings.cfg' file")
-                else:
-                    api_key = config.get("abuseipdb", "api_key")
-                    abuseipdb = AbuseIPDB(api_key)
-                    abuseipdb.aipdb_run(ip_addrs)
-
-    if args.file:
-        pbl.outdated()
+        # single ip check
+        if len(args.query) == 1:
+            ip = ip_addrs[0]
+
+            # fetch all intel sources concurrently, the checks below print from the shared responses
+            with ThreadPoolExecutor() as executor:
+                executor.submit(pbl.ip46_base, ip)
+                executor.submit(pbl.urlhaus_base, ip)
+                if virustotal:
+                    executor.submit(virustotal.vt_base, ip)
+                if abuseipdb:
+                    executor.submit(abuseipdb.aipdb_base, ip)
+
+                print(f"\n{Tc.dotsep}\n{Tc.green}[ Reputation Block List Check ]{Tc.rst}")
+                dnsbl_engine(config).dnsbl_mapper(ip_addrs)
+
+                print(f"\n{Tc.dotsep}\n{Tc.green}[ IP-46 IP Intel Check ]{Tc.rst}")
+                pbl.ip46_qry(ip)
+
+                print(f"\n{Tc.dotsep}\n{Tc.green}[ URLhaus Check ]{Tc.rst}")
+                pbl.urlhaus_qry(ip)
+
+                # VirusTotal Query
+                if virustotal:
+                    print(f"\n{Tc.dotsep}\n{Tc.green}[ VirusTotal Check ]{Tc.rst}")
+                    virustotal.vt_run(ip)
+
+                # AbuseIPDB
+                if abuseipdb:
+                    print(f"\n{Tc.dotsep}\n{Tc.green}[ AbuseIPDB Check ]{Tc.rst}")
+                    abuseipdb.aipdb_run(ip)
+
+    elif args.file:
+        if pbl.outdated():
+            print(Tc.outdated, file=sys.stderr)
         try:
-            with open(args.file) as infile:
-                ip_addrs = [line.strip() for line in infile.readlines()]
+            infile = open(args.file)
         except FileNotFoundError:
             sys.exit(f"{Tc.warning} No such file: {args.file}")
-        pbl.ip_matches(ip_addrs)
+        with infile:
+            if args.bulk:
+                pbl.bulk_matches(infile, out)
+            else:
+                pbl.ip_matches(list(pbl.read_ips(infile)))
+
+        if args.dnsbl or batches:
+            # the same addresses the blacklist check accepted
+            with open(args.file) as infile:
+                hosts = [ip for ip in pbl.read_ips(infile) if blindex.ip_to_int(ip) is not None]
+
+        if args.dnsbl:
+            print(f"\n{Tc.dotsep}\n{Tc.green}[ Reputation Block List Check ]{Tc.rst}")
+            dnsbl_engine(config).dnsbl_mapper(hosts)
+
+        if batches:
+            print(f"\n{Tc.dotsep}\n{Tc.green}[ Intel Batch Check ]{Tc.rst}")
+            intel_batch(hosts, batches)
 
     if args.show:
         pbl.list_count()
-        pbl.outdated()
+        if pbl.outdated():
+            print(f"\n{Tc.outdated}")
+
+    if args.watch:
+        from utils.scheduler import RefreshScheduler
+
+        print(f"{Tc.processing} Refreshing feeds as they come due, Ctrl-C to stop")
+        try:
+            RefreshScheduler(pbl, tick=config.getfloat("feeds", "tick", fallback=60)).run()
+        except KeyboardInterrupt:
+            pass
+
+    if args.serve is not None:
+        from utils.qryserver import QueryService, serve
+
+        service = QueryService(
+            pbl,
+            poll=config.getfloat("server", "poll", fallback=60),
+            update=config.getboolean("server", "update", fallback=True),
+            tick=config.getfloat("feeds", "tick", fallback=60),
+        )
+        serve(service, args.serve or config.get("server", "address", fallback="127.0.0.1:8080"))
+
+    if args.history:
+        if store is None:
+            sys.exit(f"{Tc.warning} Feed history is disabled -- set 'store = yes' under [feeds] in settings.cfg")
+        if writer:
+            for ip in args.history:
+                writer.write({"ip": ip, "history": store.history(ip)})
+            writer.flush()
+        else:
+            pbl.ip_history(args.history)
+
+    if args.zones:
+        dnsbl_engine(config).zone_report()
 
     if args.update:
+        dbl = dnsbl_engine(config)
         print(Tc.chk_feeds)
+        # only feeds past their refresh interval are downloaded, -fu updates all
         if bool(pbl.outdated()):
-            pbl.update_list()
+            print(f"{Tc.green}[ Updating ]{Tc.rst}")
+            pbl.refresh_due()
             pbl.list_count()
         if bool(dbl.update_dnsbl()):
             dbl.update_dnsbl()
@@ -168,10 +486,13 @@ def main():
 
     if args.force:
         pbl.update_list()
-        dbl.update_dnsbl()
+        dnsbl_engine(config).update_dnsbl()
         pbl.list_count()
 
     if args.insert:
+        import urllib.error
+        import urllib.request
+
         while True:
             try:
                 feed = input("[>] Feed name: ")
@@ -205,29 +526,12 @@ def main():
 
 
 if __name__ == "__main__":
-    banner = fr"""
-        ____  __           __   ___      __     ________              __  
-       / __ )/ /___ ______/ /__/ (_)____/ /_   / ____/ /_  ___  _____/ /__
-      / __  / / __ `/ ___/ //_/ / / ___/ __/  / /   / __ \/ _ \/ ___/ //_/
-     / /_/ / / /_/ / /__/ ,< / / (__  ) /_   / /___/ / / /  __/ /__/ ,<   
-    /_____/_/\__,_/\___/_/|_/_/_/____/\__/   \____/_/ /_/\___/\___/_/|_|
-                                                                {__version__}
-    """
-
-    print(f"{Tc.cyan}{banner}{Tc.rst}")
-
     # check if python version
     if not sys.version_info.major == 3 and sys.version_info.minor >= 8:
         print("Python 3.8 or higher is required.")
         sys.exit(f"Your Python Version: {sys.version_info.major}.{sys.version_info.minor}")
 
-    # check if new version is available
     try:
-        latest = requests.get(f"https://api.github.com/repos/dfirsec/{parent.stem}/releases/latest").json()["tag_name"]
-
-        if latest != __version__:
-            print(f"{Tc.yellow}* Release {latest} of {parent.stem} is available{Tc.rst}")
-    except Exception as err:
-        print(f"{Tc.error} [Error]{Tc.rst} {err}\n")
-
-    main()
+        main()
+    except CheckError as err:
+        sys.exit(f"{Tc.error} {err}")
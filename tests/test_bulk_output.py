@@ -0,0 +1,39 @@
+import json
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from utils import blindex
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_bulk_stdout_is_only_tsv(tmp_path):
+    """ -b writes the listed IPs to stdout, the banner and notices to stderr """
+    shutil.copy(ROOT / "blacklist_check.py", tmp_path)
+    shutil.copy(ROOT / "settings.cfg", tmp_path)
+    shutil.copytree(ROOT / "utils", tmp_path / "utils")
+    resc = tmp_path / "resc"
+    resc.mkdir()
+    shutil.copy(ROOT / "resc" / "feeds.json", resc)
+    shutil.copy(ROOT / "resc" / "scanners.json", resc)
+    # no background release check
+    (resc / "release_check.json").write_text(json.dumps({"checked": time.time()}))
+
+    listed = blindex.ip_to_int("203.0.113.7")
+    blindex.build(resc / "blacklist.idx", {"Test Feed": [(listed, listed)]})
+    ips = tmp_path / "ips.txt"
+    ips.write_text("# firewall log\n\n203.0.113.7,443\n198.51.100.1\nnot-an-ip\n")
+
+    proc = subprocess.run(
+        [sys.executable, "blacklist_check.py", "-f", str(ips), "-b"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.splitlines() == ["203.0.113.7\tTest Feed"]
+    assert "Checked 2 IPs" in proc.stderr
@@ -0,0 +1,61 @@
+import ipwhois
+from ipwhois import exceptions
+
+from utils.blworker import ProcessBL
+from utils.enrichcache import EnrichCache
+
+
+class FailingWhois:
+    def __init__(self, ip_addr):
+        pass
+
+    def lookup_whois(self):
+        raise exceptions.ASNRegistryError("ASN registry lookup failed")
+
+
+def test_failed_whois_lookup_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(ipwhois, "IPWhois", FailingWhois)
+    cache = EnrichCache(tmp_path / "enrich.db", ttls={"whois": 3600})
+
+    assert cache.get_or_fetch("whois", "1.2.3.4", ProcessBL.whois_ip) is None
+    cache.reset()
+    assert cache.get("whois", "1.2.3.4") == (False, None)
+    cache.close()
+
+
+def test_private_address_whois_is_cached(tmp_path):
+    cache = EnrichCache(tmp_path / "enrich.db", ttls={"whois": 3600})
+
+    assert cache.get_or_fetch("whois", "10.0.0.1", ProcessBL.whois_ip) == "No results"
+    cache.reset()
+    assert cache.get("whois", "10.0.0.1") == (True, "No results")
+    cache.close()
+
+
+def test_writes_are_batched_until_save(tmp_path):
+    path = tmp_path / "enrich.db"
+    cache = EnrichCache(path, ttls={"geo": 3600})
+    cache.set("geo", "1.2.3.4", "Somewhere")
+    assert cache.get("geo", "1.2.3.4") == (True, "Somewhere")
+
+    other = EnrichCache(path, ttls={"geo": 3600})
+    assert other.get("geo", "1.2.3.4") == (False, None)
+    cache.save()
+    assert other.get("geo", "1.2.3.4") == (True, "Somewhere")
+    cache.close()
+    other.close()
+
+
+def test_eviction_keeps_recently_used_entries(tmp_path):
+    cache = EnrichCache(tmp_path / "enrich.db", ttls={"geo": 3600}, max_entries=2, memo_entries=0)
+    cache.set("geo", "a", 1)
+    cache.set("geo", "b", 2)
+    cache.save()
+    cache.get("geo", "a")
+    cache.set("geo", "c", 3)
+    cache.save()
+
+    assert cache.get("geo", "a") == (True, 1)
+    assert cache.get("geo", "b") == (False, None)
+    assert cache.get("geo", "c") == (True, 3)
+    cache.close()
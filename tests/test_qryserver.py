@@ -0,0 +1,57 @@
+import http.client
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from utils import qryserver
+
+
+class StubService:
+    def check(self, ip_addrs):
+        return [{"ip": ip} for ip in ip_addrs]
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), qryserver.QueryHandler)
+    server.service = StubService()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, length):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    conn.putrequest("POST", "/check")
+    conn.putheader("Content-Length", length)
+    conn.endheaders(body)
+    resp = conn.getresponse()
+    status = resp.status
+    conn.close()
+    return status
+
+
+def test_post_check(server):
+    body = b'{"ips": ["1.2.3.4"]}'
+    assert post(server, body, str(len(body))) == 200
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_post_rejects_invalid_content_length(server, length):
+    assert post(server, b"[]", length) == 400
+
+
+def test_post_rejects_oversized_body(server):
+    assert post(server, b"", str(qryserver.MAX_BODY + 1)) == 413
+
+
+def test_serve_keeps_files_that_are_not_sockets(tmp_path):
+    path = tmp_path / "settings.cfg"
+    path.write_text("[server]\n")
+
+    with pytest.raises(SystemExit):
+        qryserver.serve(StubService(), str(path))
+    assert path.read_text() == "[server]\n"
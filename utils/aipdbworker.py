@@ -1,24 +1,28 @@
-import sys
-
-import requests
 from requests.exceptions import (ConnectionError, HTTPError, RequestException,
                                  Timeout)
 
+from utils.errors import ApiKeyError
+from utils.intelclient import IntelClient
 from utils.termcolors import Termcolor as Tc
 
 
 class AbuseIPDB:
-    def __init__(self, api_key):
+    def __init__(self, api_key, intel=None):
         self.api_key = api_key
+        self.intel = intel or IntelClient()
+        self.base_url = "https://api.abuseipdb.com/api/v2/check"
         self.headers = {"Key": api_key, "Accept": "application/json"}
-        if self.api_key is None:
-            sys.exit(f"{Tc.yellow}* Verify that you have provided your API key{Tc.rst}")
+        if not self.api_key:
+            raise ApiKeyError("Verify that you have provided your AbuseIPDB API key")
+
+    def aipdb_base(self, ip):
+        """ Returns the check response for ip """
+        params = (("ipAddress", ip), ("confidenceMinimum", "90"))
+        return self.intel.get("abuseipdb", self.base_url, headers=self.headers, params=params)
 
     def aipdb_run(self, ip):
-        self.params = ("ipAddress", ip), ("confidenceMinimum", "90")
-        self.base_url = f"https://api.abuseipdb.com/api/v2/check"
         try:
-            resp = requests.get(self.base_url, headers=self.headers, params=self.params).json()
+            resp = self.aipdb_base(ip).json()
         except (ConnectionError, HTTPError, RequestException, Timeout):
             print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{Tc.rst}")
         except KeyError:
@@ -26,6 +30,47 @@ class AbuseIPDB:
         else:
             ip_addr = resp["data"]["ipAddress"]
             if bool(ip_addr):
-                print(f"{Tc.blacklisted} {''.join(ip)}")
+                print(f"{Tc.blacklisted} {ip}")
             else:
                 print(Tc.clean)
+
+    # ---[ AbuseIPDB Batch ]---
+    def aipdb_report(self, ip):
+        """ Returns the report data for ip, or None if it could not be fetched """
+        try:
+            resp = self.aipdb_base(ip)
+        except (ConnectionError, HTTPError, RequestException, Timeout):
+            return None
+        if resp.status_code == 401:
+            raise ApiKeyError("Invalid AbuseIPDB API key.")
+        if resp.status_code == 200:
+            return resp.json().get("data")
+
+    @staticmethod
+    def aipdb_record(data):
+        """ Returns the confidence score and report count of the report data, or None for a failed lookup """
+        if data is None:
+            return None
+        return {"score": data.get("abuseConfidenceScore", 0), "reports": data.get("totalReports", 0)}
+
+    @staticmethod
+    def aipdb_summary(data):
+        score = data.get("abuseConfidenceScore", 0)
+        if not score:
+            return Tc.clean
+        return f"Confidence: {score}%, Reports: {data.get('totalReports', 0)}"
+
+    def aipdb_cached(self, ip, cache, quota):
+        """ Returns the cached report data for ip, fetching it at the pace quota allows, or None if it could not be fetched """
+
+        def fetch(ip):
+            quota.acquire("abuseipdb")
+            return self.aipdb_report(ip)
+
+        return cache.get_or_fetch("abuseipdb", ip, fetch)
+
+    def aipdb_batch(self, ips, cache, quota):
+        """ Yields (ip, summary) for each ip, fetching uncached reports at the pace quota allows """
+        for ip in ips:
+            data = self.aipdb_cached(ip, cache, quota)
+            yield ip, None if data is None else self.aipdb_summary(data)
@@ -0,0 +1,31 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    """ Writes to a temporary file next to path and renames it into place when the block completes
+
+    Readers see either the old or the new file, never a partial one, and a
+    failed write leaves the old file untouched.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with open(fd, mode, **kwargs) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        try:
+            os.chmod(tmp, os.stat(path).st_mode)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,89 @@
+"""
+Vectorized matching of large IP batches, used when NumPy is installed.
+"""
+from utils import blindex
+
+# imported by available(), so callers that never reach the batch threshold skip the NumPy import
+np = None
+_probed = False
+
+# below this many IPs the per-IP index lookup is faster (see bench/batch_match.py)
+BATCH_THRESHOLD = 5000
+
+
+def available():
+    global np, _probed
+    if not _probed:
+        _probed = True
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np is not None
+
+
+class BatchMatcher:
+    """ Matches a batch of IP integers against the merged segment table in one sorted search
+
+    The tables hold IPv4 segments only; IPv6 keys in a batch are passed to `lookup6`,
+    which returns the names of the feeds covering one key.
+    """
+
+    def __init__(self, names, segments, postings, feed_ids, lookup6=None):
+        self.names = list(names)
+        self._columns = {name: col for col, name in enumerate(self.names)}
+        self._lookup6 = lookup6 or (lambda value: [])
+        pairs = np.array(segments, dtype=np.uint32).reshape(-1, 2)
+        self._starts = np.ascontiguousarray(pairs[:, 0])
+        self._ends = np.ascontiguousarray(pairs[:, 1])
+        self._postings = np.array(postings, dtype=np.int64)
+        self._ids = np.array(feed_ids, dtype=np.int64)
+
+    @classmethod
+    def from_index(cls, index):
+        """ Copies the segment tables out of a BlacklistIndex """
+        return cls(index.feeds, *index.segment_tables(), lookup6=index.lookup)
+
+    @classmethod
+    def from_feeds(cls, feeds):
+        """ Builds the segment tables from a dict of feed name and (start, end) intervals """
+        segments, postings, feed_ids = blindex.segments(blindex.split(intervals)[0] for intervals in feeds.values())
+
+        def lookup6(value):
+            return [name for name, intervals in feeds.items() if blindex.covers(intervals, value)]
+
+        return cls(feeds, [value for segment in segments for value in segment], postings, feed_ids, lookup6)
+
+    def match(self, values):
+        """ Returns a boolean matrix of queries x feeds """
+        values = list(values)
+        rows6 = [row for row, value in enumerate(values) if value >= blindex.V6_BASE]
+        if rows6:
+            queries = np.array([0 if value >= blindex.V6_BASE else value for value in values], dtype=np.uint32)
+        else:
+            queries = np.asarray(values, dtype=np.uint32)
+        matrix = np.zeros((len(queries), len(self.names)), dtype=bool)
+        for row in rows6:
+            for name in self._lookup6(values[row]):
+                matrix[row, self._columns[name]] = True
+        if not len(self._starts) or not len(queries):
+            return matrix
+
+        pos = np.searchsorted(self._starts, queries, side="right") - 1
+        hit = (pos >= 0) & (self._ends[np.maximum(pos, 0)] >= queries)
+        hit[rows6] = False
+        rows = np.nonzero(hit)[0]
+        lo = self._postings[pos[rows]]
+        cnt = self._postings[pos[rows] + 1] - lo
+
+        # expand each hit row into one (row, feed id) pair per covering feed
+        ends = np.cumsum(cnt)
+        offsets = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - cnt, cnt)
+        matrix[np.repeat(rows, cnt), self._ids[np.repeat(lo, cnt) + offsets]] = True
+        return matrix
+
+    def matches(self, values):
+        """ Yields (query position, feed name) for every match, ordered by query """
+        rows, cols = np.nonzero(self.match(values))
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            yield row, self.names[col]
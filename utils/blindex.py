@@ -0,0 +1,398 @@
+"""
+Compact on-disk blacklist index.
+
+Feeds are stored as sorted, non-overlapping (start, end) intervals of
+address keys, so single IPs, CIDR blocks and ranges share one representation.
+An IPv4 address is keyed by its 32-bit value and an IPv6 address by
+V6_BASE + its 128-bit value, so both families sort and merge in one integer
+space (IPv4-mapped IPv6 addresses are keyed as IPv4).
+
+Layout (little-endian):
+    header      magic b"BLIX", version (H), reserved (H), feed count (I),
+                IPv4 and IPv6 segment counts (I), then offsets (Q) of the IPv4 segments,
+                IPv6 segments, postings and feed ids
+    feed table  per feed: name length (H), utf-8 name, IPv4 interval count (i, -1 = download error),
+                address count (Q), data offset (Q), IPv6 interval count (I), IPv6 data offset (Q)
+    data        per feed: uint32 (start, end) pairs, then uint64 (start hi, start lo, end hi, end lo)
+                IPv6 quads, 8-byte aligned
+    segments    uint32 (start, end) pairs of the disjoint IPv4 ranges covered by any feed
+    segments6   uint64 (start hi, start lo, end hi, end lo) quads of the disjoint IPv6 ranges
+    postings    uint32 start position in the feed ids for each IPv4 then IPv6 segment, plus a final end position
+    feed ids    uint16 feed ids covering each segment, padded to 4 bytes
+"""
+import math
+import mmap
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from utils.atomicfile import atomic_open
+
+MAGIC = b"BLIX"
+VERSION = 4
+
+# IPv6 address keys start above the IPv4 range
+V6_BASE = 1 << 32
+_U64 = (1 << 64) - 1
+
+_header = struct.Struct("<4sHHIIIQQQQ")
+_name_len = struct.Struct("<H")
+_feed_entry = struct.Struct("<iQQIQ")
+
+
+def ip_to_int(ip_addr):
+    """ Returns the address key of an IPv4 or IPv6 address, or None if invalid """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip_addr), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_addr), "big")
+    except (OSError, TypeError):
+        return None
+    if value >> 32 == 0xFFFF:
+        return value & 0xFFFFFFFF
+    return V6_BASE + value
+
+
+def int_to_ip(value):
+    if value < V6_BASE:
+        return socket.inet_ntoa(struct.pack("!I", value))
+    return socket.inet_ntop(socket.AF_INET6, (value - V6_BASE).to_bytes(16, "big"))
+
+
+def cidr_to_range(ip_addr, prefix):
+    """ Returns the (start, end) keys of the network, or None if invalid """
+    value = ip_to_int(ip_addr)
+    if value is None:
+        return None
+    if value < V6_BASE:
+        if ":" in ip_addr:
+            # IPv4-mapped IPv6 network
+            prefix -= 96
+        base, bits = 0, 32
+    else:
+        base, bits = V6_BASE, 128
+    if not 0 <= prefix <= bits:
+        return None
+    host_bits = bits - prefix
+    start = (value - base) >> host_bits << host_bits
+    return base + start, base + start + (1 << host_bits) - 1
+
+
+def _join(pairs, merged):
+    """ Appends the sorted (start, end) pairs to merged, joining overlapping and adjacent ones """
+    last_start = last_end = -2
+    for start, end in pairs:
+        if start <= last_end + 1:
+            if end > last_end:
+                last_end = end
+        else:
+            if last_end >= 0:
+                merged.append((last_start, last_end))
+            last_start, last_end = start, end
+    if last_end >= 0:
+        merged.append((last_start, last_end))
+
+
+def merge(intervals):
+    """ Returns sorted, non-overlapping (start, end) intervals, joining adjacent ones """
+    v4 = []
+    v6 = []
+    for start, end in intervals:
+        if start < V6_BASE:
+            # packed integers sort much faster than tuples
+            v4.append(start << 32 | end)
+        else:
+            v6.append((start, end))
+    merged = []
+    _join(((key >> 32, key & 0xFFFFFFFF) for key in sorted(v4)), merged)
+    # joined separately, so the last IPv4 address never merges with the first IPv6 key
+    _join(sorted(v6), merged)
+    return merged
+
+
+def split(intervals):
+    """ Returns the IPv4 and IPv6 parts of merged intervals """
+    pos = bisect_left(intervals, (V6_BASE, 0))
+    return intervals[:pos], intervals[pos:]
+
+
+def address_count(intervals):
+    """ Returns the number of IPv4 addresses plus the number of IPv6 networks and addresses """
+    v4, v6 = split(intervals)
+    return sum(end - start + 1 for start, end in v4) + len(v6)
+
+
+def covers(intervals, value):
+    """ Returns True if the address key falls inside one of the merged intervals """
+    pos = bisect_right(intervals, (value, math.inf)) - 1
+    return pos >= 0 and intervals[pos][1] >= value
+
+
+def segments(feed_intervals):
+    """ Splits the feeds into disjoint (start, end) segments, each with the ids of the feeds covering it
+
+    Returns the segments, the uint32 postings (start position of each segment's ids,
+    plus a final end position) and the uint16 feed ids.
+    """
+    # events packed as boundary | opening flag | feed id, so a plain int sort orders them
+    events = []
+    for feed_id, intervals in enumerate(feed_intervals):
+        for start, end in intervals or ():
+            events.append(start << 17 | 1 << 16 | feed_id)
+            events.append((end + 1) << 17 | feed_id)
+    events.sort()
+
+    segments = []
+    segment_ids = []
+    active = set()
+    pos = 0
+    while pos < len(events):
+        boundary = events[pos] >> 17
+        while pos < len(events) and events[pos] >> 17 == boundary:
+            if events[pos] >> 16 & 1:
+                active.add(events[pos] & 0xFFFF)
+            else:
+                active.discard(events[pos] & 0xFFFF)
+            pos += 1
+
+        # an open interval always has a closing event further on
+        if active:
+            ids = sorted(active)
+            end = (events[pos] >> 17) - 1
+            if segments and segments[-1][1] == boundary - 1 and boundary != V6_BASE and segment_ids[-1] == ids:
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((boundary, end))
+                segment_ids.append(ids)
+
+    postings = array("I", [0])
+    feed_ids = array("H")
+    for ids in segment_ids:
+        feed_ids.extend(ids)
+        postings.append(len(feed_ids))
+    return segments, postings, feed_ids
+
+
+def _as_array(typecode, values):
+    """ Returns an array of unsigned integers in little-endian byte order """
+    arr = array(typecode, values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def _pairs(intervals):
+    return _as_array("I", (value for interval in intervals for value in interval))
+
+
+def _quads(intervals):
+    """ Returns IPv6 intervals as uint64 (start hi, start lo, end hi, end lo) quads """
+    values = []
+    for start, end in intervals:
+        start -= V6_BASE
+        end -= V6_BASE
+        values += (start >> 64, start & _U64, end >> 64, end & _U64)
+    return _as_array("Q", values)
+
+
+def _decode_quads(quads):
+    """ Returns the IPv6 (start, end) keys of uint64 quads """
+    return [
+        (V6_BASE + (quads[i] << 64 | quads[i + 1]), V6_BASE + (quads[i + 2] << 64 | quads[i + 3]))
+        for i in range(0, len(quads), 4)
+    ]
+
+
+def build(path, blacklists):
+    """ Writes the index for a dict of feed name and (start, end) intervals (None for download errors) """
+    names = list(blacklists)
+    if len(names) > 0xFFFF:
+        raise ValueError(f"Too many feeds for the index: {len(names)}")
+    values = [None if blacklists[name] is None else merge(blacklists[name]) for name in names]
+
+    segment_list, postings, feed_ids = segments(values)
+    segments4, segments6 = split(segment_list)
+
+    table_size = sum(_name_len.size + len(name.encode("utf-8")) + _feed_entry.size for name in names)
+    offset = _header.size + table_size
+    # 8-byte aligned, every data section after it is a multiple of 8 bytes
+    offset += -offset % 8
+
+    table = bytearray()
+    for name, intervals in zip(names, values):
+        encoded = name.encode("utf-8")
+        table += _name_len.pack(len(encoded)) + encoded
+        if intervals is None:
+            table += _feed_entry.pack(-1, 0, offset, 0, offset)
+        else:
+            v4, v6 = split(intervals)
+            offset6 = offset + len(v4) * 8
+            table += _feed_entry.pack(len(v4), address_count(intervals), offset, len(v6), offset6)
+            offset = offset6 + len(v6) * 32
+
+    segments_offset = offset
+    segments6_offset = segments_offset + len(segments4) * 8
+    postings_offset = segments6_offset + len(segments6) * 32
+    ids_offset = postings_offset + len(postings) * 4
+
+    with atomic_open(path, "wb") as idx_file:
+        idx_file.write(
+            _header.pack(
+                MAGIC,
+                VERSION,
+                0,
+                len(names),
+                len(segments4),
+                len(segments6),
+                segments_offset,
+                segments6_offset,
+                postings_offset,
+                ids_offset,
+            )
+        )
+        idx_file.write(table)
+        idx_file.write(b"\0" * (-(_header.size + len(table)) % 8))
+        for intervals in values:
+            if intervals is not None:
+                v4, v6 = split(intervals)
+                _pairs(v4).tofile(idx_file)
+                _quads(v6).tofile(idx_file)
+        _pairs(segments4).tofile(idx_file)
+        _quads(segments6).tofile(idx_file)
+        _as_array("I", postings).tofile(idx_file)
+        _as_array("H", feed_ids).tofile(idx_file)
+        idx_file.write(b"\0" * (len(feed_ids) * 2 % 4))
+
+
+class BlacklistIndex:
+    """ Read-only view of the index, memory-mapped and searched in place """
+
+    def __init__(self, path, in_memory=False):
+        """ Maps the index file, or with in_memory reads it whole, so a later rewrite of the file cannot affect it """
+        if in_memory:
+            self._file = None
+            with open(path, "rb") as idx_file:
+                self._map = idx_file.read()
+            if not self._map:
+                raise ValueError(f"Empty index file: {path}")
+        else:
+            self._file = open(path, "rb")
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._file.close()
+                raise ValueError(f"Empty index file: {path}")
+
+        (
+            magic,
+            version,
+            _,
+            feed_cnt,
+            segment_cnt,
+            segment6_cnt,
+            segments_offset,
+            segments6_offset,
+            postings_offset,
+            ids_offset,
+        ) = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported index file: {path}")
+
+        self._names = []
+        self._feeds = {}
+        pos = _header.size
+        for _ in range(feed_cnt):
+            (length,) = _name_len.unpack_from(self._map, pos)
+            pos += _name_len.size
+            name = bytes(self._map[pos : pos + length]).decode("utf-8")
+            pos += length
+            self._names.append(name)
+            self._feeds[name] = _feed_entry.unpack_from(self._map, pos)
+            pos += _feed_entry.size
+
+        self._view = memoryview(self._map)
+        self._segments = self._array("I", segments_offset, segment_cnt * 2)
+        self._starts = self._segments[0::2]
+        self._ends = self._segments[1::2]
+        self._segments6 = self._array("Q", segments6_offset, segment6_cnt * 4)
+        # IPv6 segment bounds, decoded on the first IPv6 lookup
+        self._bounds6 = None
+        self._postings = self._array("I", postings_offset, segment_cnt + segment6_cnt + 1)
+        self._ids = self._array("H", ids_offset, self._postings[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _array(self, typecode, offset, count):
+        """ Returns a zero-copy view of the section (copied on big-endian hosts) """
+        size = array(typecode).itemsize
+        section = self._view[offset : offset + count * size]
+        if sys.byteorder == "little":
+            return section.cast(typecode)
+        arr = array(typecode, section.tobytes())
+        arr.byteswap()
+        return arr
+
+    def close(self):
+        if hasattr(self, "_view"):
+            for section in (self._starts, self._ends, self._segments, self._segments6, self._postings, self._ids):
+                if isinstance(section, memoryview):
+                    section.release()
+            self._view.release()
+        if self._file is not None:
+            self._map.close()
+            self._file.close()
+
+    @property
+    def feeds(self):
+        return list(self._names)
+
+    def count(self, name):
+        """ Returns the number of addresses covered by the feed, or None for a failed download """
+        intervals, addresses, *_ = self._feeds[name]
+        return None if intervals < 0 else addresses
+
+    def feed(self, name):
+        """ Returns the feed's (start, end) intervals, or None for a failed download """
+        intervals, _, offset, intervals6, offset6 = self._feeds[name]
+        if intervals < 0:
+            return None
+        pairs = self._array("I", offset, intervals * 2)
+        return list(zip(pairs[0::2], pairs[1::2])) + _decode_quads(self._array("Q", offset6, intervals6 * 4))
+
+    def segment_tables(self):
+        """ Returns the IPv4 (start, end) segments, postings and feed ids as flat integer sequences """
+        return self._segments, self._postings, self._ids
+
+    def lookup(self, value):
+        """ Returns the names of all feeds covering the address key """
+        if value >= V6_BASE:
+            return self._lookup6(value)
+        pos = bisect_right(self._starts, value) - 1
+        if pos < 0 or value > self._ends[pos]:
+            return []
+        return [self._names[feed_id] for feed_id in self._ids[self._postings[pos] : self._postings[pos + 1]]]
+
+    def _lookup6(self, value):
+        if self._bounds6 is None:
+            bounds = _decode_quads(self._segments6)
+            self._bounds6 = ([start for start, _ in bounds], [end for _, end in bounds])
+        starts, ends = self._bounds6
+        pos = bisect_right(starts, value) - 1
+        if pos < 0 or value > ends[pos]:
+            return []
+        # IPv6 postings follow the IPv4 ones
+        pos += len(self._starts)
+        return [self._names[feed_id] for feed_id in self._ids[self._postings[pos] : self._postings[pos + 1]]]
+
+    def to_dict(self):
+        """ Returns a copy of every feed as a dict of feed name and (start, end) intervals """
+        return {name: self.feed(name) for name in self._names}
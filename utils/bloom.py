@@ -0,0 +1,188 @@
+"""
+Bloom filter over the union of all feeds and scanner lists, used to reject clean
+IPs in bulk checks before the exact index lookup.
+
+Single addresses and short ranges are hashed into the bit array; wider ranges
+are kept exactly as sorted (start, end) intervals, since expanding a /8 would
+fill the filter. The file records the index it was built for and is ignored
+once that index is replaced, so a stale filter never hides a listed IP.
+
+Layout (little-endian):
+    header      magic b"BLBF", version (H), hash count (H), bit count (Q),
+                index mtime (Q, ns), index size (Q), scanners mtime (Q, ns), wide interval count (I)
+    bits        bit array, bit i in byte i >> 3
+    wide        17-byte big-endian (start, end) address keys of the wide intervals
+"""
+import math
+import os
+import struct
+from bisect import bisect_right
+
+from utils import batchmatch, blindex
+from utils.atomicfile import atomic_open
+
+MAGIC = b"BLBF"
+VERSION = 1
+
+# ranges up to this many addresses are hashed address by address
+MAX_EXPAND = 16
+
+_header = struct.Struct("<4sHHQQQQI")
+_KEY_BYTES = 17
+_U64 = (1 << 64) - 1
+
+
+def _fold(value):
+    """ Folds an address key into 64 bits, IPv4 keys are unchanged """
+    return (value ^ (value >> 64)) & _U64
+
+
+def _mix(x):
+    """ splitmix64 finalizer """
+    x = (x + 0x9E3779B97F4A7C15) & _U64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _U64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _U64
+    return x ^ (x >> 31)
+
+
+def identity(index_path, scanners_path):
+    """ Returns the (index mtime, index size, scanners mtime) the filter is valid for """
+    index_stat = os.stat(index_path)
+    return index_stat.st_mtime_ns, index_stat.st_size, os.stat(scanners_path).st_mtime_ns
+
+
+class BloomFilter:
+    def __init__(self, bits, bit_count, hashes, wide, ident=(0, 0, 0)):
+        self.bits = bits
+        self.bit_count = bit_count
+        self.hashes = hashes
+        self.wide = wide
+        self.identity = ident
+        self._starts = [start for start, _ in wide]
+        self._arrays = None
+
+    @classmethod
+    def build(cls, feed_intervals, fp_rate=0.01, ident=(0, 0, 0)):
+        """ Builds the filter for the union of the feeds' (start, end) intervals """
+        union = blindex.merge(
+            interval for intervals in feed_intervals if intervals is not None for interval in intervals
+        )
+        keys = []
+        wide = []
+        for start, end in union:
+            if end - start < MAX_EXPAND:
+                keys.extend(range(start, end + 1))
+            else:
+                wide.append((start, end))
+
+        # optimal size and hash count for the expected number of keys
+        count = max(len(keys), 1)
+        bit_count = max(64, math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2 / 64) * 64)
+        hashes = max(1, round(bit_count / count * math.log(2)))
+
+        bloom = cls(bytearray(bit_count // 8), bit_count, hashes, wide, ident)
+        if batchmatch.available() and len(keys) >= batchmatch.BATCH_THRESHOLD:
+            np = batchmatch.np
+            bits = np.frombuffer(bloom.bits, dtype=np.uint8)
+            folded = np.array([_fold(key) for key in keys], dtype=np.uint64)
+            for positions in bloom._positions_np(folded):
+                np.bitwise_or.at(bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        else:
+            for key in keys:
+                for pos in bloom._positions(key):
+                    bloom.bits[pos >> 3] |= 1 << (pos & 7)
+        return bloom
+
+    def _positions(self, value):
+        h = _mix(_fold(value))
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hashes)]
+
+    def _positions_np(self, folded):
+        """ Yields an array of bit positions of every folded key for each hash """
+        np = batchmatch.np
+        with np.errstate(over="ignore"):
+            x = folded + np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x ^= x >> np.uint64(31)
+        h1 = x & np.uint64(0xFFFFFFFF)
+        h2 = (x >> np.uint64(32)) | np.uint64(1)
+        for i in range(self.hashes):
+            yield ((h1 + np.uint64(i) * h2) % np.uint64(self.bit_count)).astype(np.int64)
+
+    def _in_wide(self, value):
+        pos = bisect_right(self._starts, value) - 1
+        return pos >= 0 and self.wide[pos][1] >= value
+
+    def __contains__(self, value):
+        """ False if no feed lists the address key, True if one may """
+        if self._in_wide(value):
+            return True
+        return all(self.bits[pos >> 3] >> (pos & 7) & 1 for pos in self._positions(value))
+
+    def contains_many(self, values):
+        """ Returns a list of `value in self` for the address keys, vectorized for large batches """
+        if not (batchmatch.available() and len(values) >= batchmatch.BATCH_THRESHOLD):
+            return [value in self for value in values]
+
+        np = batchmatch.np
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        folded = np.array([_fold(value) for value in values], dtype=np.uint64)
+        hit = np.ones(len(values), dtype=bool)
+        for positions in self._positions_np(folded):
+            hit &= ((bits[positions >> 3] >> (positions & 7)) & 1).astype(bool)
+
+        if self.wide:
+            if self._arrays is None:
+                ipv4 = blindex.split(self.wide)[0]
+                self._arrays = (
+                    np.array([start for start, _ in ipv4], dtype=np.uint64),
+                    np.array([end for _, end in ipv4], dtype=np.uint64),
+                )
+            starts, ends = self._arrays
+            if len(starts):
+                # folded IPv4 keys are the keys themselves, a folded IPv6 key can only add a false positive
+                pos = np.searchsorted(starts, folded, side="right") - 1
+                hit |= (pos >= 0) & (ends[np.maximum(pos, 0)] >= folded)
+            if len(starts) < len(self.wide):
+                for row, value in enumerate(values):
+                    if value >= blindex.V6_BASE and self._in_wide(value):
+                        hit[row] = True
+        return hit.tolist()
+
+    # ---[ Persistence ]---
+    def save(self, path):
+        with atomic_open(path, "wb") as bloom_file:
+            bloom_file.write(
+                _header.pack(MAGIC, VERSION, self.hashes, self.bit_count, *self.identity, len(self.wide))
+            )
+            bloom_file.write(self.bits)
+            bloom_file.write(
+                b"".join(
+                    start.to_bytes(_KEY_BYTES, "big") + end.to_bytes(_KEY_BYTES, "big") for start, end in self.wide
+                )
+            )
+
+    @classmethod
+    def load(cls, path, ident=None):
+        """ Returns the saved filter, or None if it is missing, unreadable or built for another index """
+        try:
+            with open(path, "rb") as bloom_file:
+                data = bloom_file.read()
+            magic, version, hashes, bit_count, *saved, wide_count = _header.unpack_from(data, 0)
+        except (OSError, struct.error):
+            return None
+        if magic != MAGIC or version != VERSION or (ident is not None and tuple(saved) != tuple(ident)):
+            return None
+
+        offset = _header.size + bit_count // 8
+        bits = bytearray(data[_header.size : offset])
+        wide = []
+        for pos in range(offset, offset + wide_count * _KEY_BYTES * 2, _KEY_BYTES * 2):
+            start = int.from_bytes(data[pos : pos + _KEY_BYTES], "big")
+            end = int.from_bytes(data[pos + _KEY_BYTES : pos + _KEY_BYTES * 2], "big")
+            wide.append((start, end))
+        if len(bits) != bit_count // 8 or len(wide) != wide_count:
+            return None
+        return cls(bits, bit_count, hashes, wide, tuple(saved))
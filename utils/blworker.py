@@ -1,57 +1,63 @@
+import hashlib
 import json
-import logging
 import os
 import platform
 import random
-import re
 import sys
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 
-import coloredlogs
-import httpx
-import requests
-import trio
-import urllib3
-import verboselogs
-from bs4 import BeautifulSoup
-from ipwhois import IPWhois, exceptions
-from querycontacts import ContactFinder
-from dns.exception import DNSException
-
+from utils import batchmatch, blindex, bloom, feedparsers, logsetup, records
+from utils.atomicfile import atomic_open
+from utils.blindex import BlacklistIndex
+from utils.enrichcache import DEFAULT_TTLS, EnrichCache
+from utils.intelclient import IntelClient
 from utils.termcolors import Termcolor as Tc
 
 # suppress dnspython feature deprecation warning
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-# suppress certificate verification
-urllib3.disable_warnings()
-
 # Base directory paths
 parent = Path(__file__).resolve().parent.parent
-blklist = parent.joinpath("resc/blacklist.json")
+blklist = parent.joinpath("resc/blacklist.idx")
+bloom_file = parent.joinpath("resc/blacklist.bloom")
 scnrs = parent.joinpath("resc/scanners.json")
 feeds = parent.joinpath("resc/feeds.json")
+feed_meta = parent.joinpath("resc/feed_meta.json")
+enrich_db = parent.joinpath("resc/enrich_cache.db")
+feed_db = parent.joinpath("resc/feed_store.db")
+
+# seconds before a failed feed download is retried, unless its interval is shorter
+RETRY_FAILED = 3600
 
-logger = verboselogs.VerboseLogger(__name__)
-logger.setLevel(logging.INFO)
-coloredlogs.install(
-    level="DEBUG",
-    logger=logger,
-    fmt="%(message)s",
-    level_styles={
-        "notice": {"color": "black", "bright": True},
-        "warning": {"color": "yellow"},
-        "success": {"color": "white", "bold": True},
-        "error": {"color": "red"},
-        "critical": {"background": "red"},
-    },
-)
+# network, parsing and lookup libraries are imported by the methods that use them, to keep startup fast
+logger = logsetup.get_logger(__name__)
 
 
 class ProcessBL:
+    def __init__(
+        self, concurrency=16, timeout=30, cache=None, workers=25, intel=None, interval=86400, store=None, fp_rate=0.01
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.interval = interval
+        self.workers = workers
+        self.previous = {}
+        self.feed_meta = {}
+        self.formats = {}
+        self.changed = set()
+        self.entries = {}
+        self.stored = set()
+        self.store = store
+        self.fp_rate = fp_rate
+        self.cache = cache or EnrichCache(enrich_db, ttls=DEFAULT_TTLS)
+        self.intel = intel or IntelClient()
+        self.qf = None
+
     @staticmethod
     def headers():
         ua_list = [
@@ -75,78 +81,292 @@ class ProcessBL:
         else:
             os.system("clear")
 
-    async def fetch(self, url):
-        async with httpx.AsyncClient(verify=False) as client:
+    async def fetch(self, client, limiter, name, url, results):
+        """ Downloads a single feed, bounded by the shared limiter and per-feed timeout """
+        import httpx
+        import trio
+
+        prev = self.previous.get(name)
+        fmt, options = self.formats.get(name, ("regex", {}))
+        meta = self.feed_meta.get(name, {})
+        if meta.get("url") != url or meta.get("parser") != [fmt, options]:
+            meta = {}
+
+        # a feed new to the store is downloaded in full, since the store keeps its unmerged entries
+        if self.store is not None and name not in self.stored:
+            prev = None
+
+        # only send validators when the previous ip set can be reused
+        req_headers = self.headers()
+        if prev is not None:
+            if meta.get("etag"):
+                req_headers["if-none-match"] = meta["etag"]
+            if meta.get("last_modified"):
+                req_headers["if-modified-since"] = meta["last_modified"]
+
+        async with limiter:
+            start = time.perf_counter()
             try:
-                resp = await client.get(url, timeout=10.0, headers=self.headers())
-                resp.raise_for_status()
-                return resp.text
-            except httpx.TimeoutException:
-                print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{url}{Tc.rst}")
-            except httpx.RequestError:
-                print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{url}{Tc.rst}")
-            except httpx.HTTPStatusError:
-                print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{url}{Tc.rst}")
-
-    def get_feeds(self, feed):
-        ipv4 = re.compile(r"(?![0])\d+\.\d{1,3}\.\d{1,3}\.(?![0])\d{1,3}")
+                with trio.fail_after(self.timeout):
+                    resp = await client.get(url, headers=req_headers)
+                    if resp.status_code != 304:
+                        resp.raise_for_status()
+            except (trio.TooSlowError, httpx.TimeoutException, httpx.RequestError, httpx.HTTPStatusError) as err:
+                results[name] = None
+                self.feed_meta[name] = dict(meta, url=url, failed=time.time(), error=(str(err) or type(err).__name__).splitlines()[0])
+                print(f"  {Tc.error} {name:25}{Tc.dl_error} {Tc.gray}{url}{Tc.rst}")
+                return
+
+        elapsed = time.perf_counter() - start
+        if resp.status_code == 304:
+            results[name] = prev
+            status = "not modified"
+        else:
+            digest = hashlib.sha256(resp.content).hexdigest()
+            if prev is not None and digest == meta.get("sha256"):
+                results[name] = prev
+                status = "unchanged"
+            else:
+                parse_start = time.perf_counter()
+                if self.store is None:
+                    results[name] = self.parse_feed(resp.text, fmt, **options)
+                else:
+                    # the store diffs the entries as listed, so merging neighbours keeps their first seen time
+                    self.entries[name] = feedparsers.entries(resp.text.splitlines(), fmt, **options)
+                    results[name] = blindex.merge(self.entries[name])
+                meta["parse_time"] = round(time.perf_counter() - parse_start, 4)
+                self.changed.add(name)
+                status = "updated"
+            meta.update(
+                url=url,
+                parser=[fmt, options],
+                etag=resp.headers.get("etag"),
+                last_modified=resp.headers.get("last-modified"),
+                sha256=digest,
+                size=len(resp.content),
+            )
+
+        # last success, alongside the last failure ("failed") kept from earlier attempts
+        meta.update(fetched=time.time(), addresses=blindex.address_count(results[name]))
+        self.feed_meta[name] = meta
+        logger.success(
+            f"  {Tc.processing} {name:25}{blindex.address_count(results[name]):>9,} IPs {Tc.gray}{elapsed:6.2f}s  {status}{Tc.rst}"
+        )
+
+    async def fetch_all(self, feed_list):
+        """ Downloads all feeds concurrently over a single pooled client """
+        import httpx
+        import trio
+
+        results = {}
+        limiter = trio.CapacityLimiter(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(verify=False, limits=limits, timeout=self.timeout) as client:
+            async with trio.open_nursery() as nursery:
+                for name, url in feed_list:
+                    nursery.start_soon(self.fetch, client, limiter, name, url, results)
+
+        # preserve the configured feed order
+        return {name: results.get(name) for name, _ in feed_list}
+
+    @staticmethod
+    def parse_feed(text, fmt="regex", **options):
+        """ Returns the merged (start, end) intervals of the feed text, parsed as the given feed format """
+        return feedparsers.parse(text.splitlines(), fmt, **options)
+
+    def get_feeds(self, feed_list, previous=None):
+        """ Returns a dict of feed name and IP addresses for each (name, url) pair
+
+        Feeds found in 'previous' are requested conditionally and keep their
+        previous IP addresses when the server content has not changed.
+        """
+        import trio
+
+        logsetup.install(logger)
+        self.previous = previous or {}
+        self.feed_meta = self.read_meta()
+        self.formats = self.feed_formats()
+        self.changed = set()
+        self.entries = {}
+        self.stored = self.store.names() if self.store is not None else set()
         try:
-            results = trio.run(self.fetch, feed)
-            ip = [ip.group() for ip in re.finditer(ipv4, results)]
-            return ip
-        except (TypeError, OSError):
-            pass
+            results = trio.run(self.fetch_all, feed_list)
+        finally:
+            self.write_meta(self.feed_meta)
+        if self.store is not None:
+            # only the feeds whose content changed are diffed against the store
+            feeds = {name: self.entries.get(name, intervals) for name, intervals in results.items()}
+            self.store.sync(feeds, self.changed)
+            self.entries = {}
+        return results
 
     @staticmethod
-    def read_list():
-        """ Returns the name and url for each feed """
+    def read_meta():
+        """ Returns the cached ETag, Last-Modified and content hash for each feed """
+        try:
+            with open(feed_meta) as json_file:
+                return json.load(json_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def write_meta(data):
+        with atomic_open(feed_meta) as json_file:
+            json.dump(data, json_file, ensure_ascii=False, indent=4)
+
+    @staticmethod
+    def read_index():
+        """ Returns a dict of feed name and IP integers from the blacklist index """
+        try:
+            with BlacklistIndex(blklist) as index:
+                return index.to_dict()
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def read_feeds():
+        """ Returns the configured feeds, as a dict of feed name and url or {"url", "interval" (hours)} """
         with open(feeds) as json_file:
-            data = json.load(json_file)
-            return [[name, url] for name, url in data["Blacklist Feeds"].items()]
+            return json.load(json_file)["Blacklist Feeds"]
 
     @staticmethod
-    def sort_list(data):
-        sort_name = sorted((name, ip_cnt) for (name, ip_cnt) in data["Blacklists"].items())
+    def feed_url(entry):
+        return entry["url"] if isinstance(entry, dict) else entry
+
+    def read_list(self):
+        """ Returns the name and url for each feed """
+        return [[name, self.feed_url(entry)] for name, entry in self.read_feeds().items()]
+
+    def feed_formats(self):
+        """ Returns the parser format and options for each feed that sets a format """
+        formats = {}
+        for name, entry in self.read_feeds().items():
+            if isinstance(entry, dict) and entry.get("format"):
+                if entry["format"] not in feedparsers.PARSERS:
+                    print(f"{Tc.warning} Unknown format '{entry['format']}' for {name}, using regex")
+                    continue
+                options = {k: v for k, v in entry.items() if k not in ("url", "interval", "format")}
+                formats[name] = (entry["format"], options)
+        return formats
+
+    def intervals(self):
+        """ Returns the refresh interval in seconds for each feed, falling back to the default interval """
+        return {
+            name: entry["interval"] * 3600 if isinstance(entry, dict) and entry.get("interval") else self.interval
+            for name, entry in self.read_feeds().items()
+        }
+
+    @staticmethod
+    def age(seconds):
+        """ Returns a short human readable age, e.g. 3h 12m """
+        if seconds is None:
+            return "never"
+        minutes = int(seconds // 60)
+        if minutes < 60:
+            return f"{minutes}m"
+        if minutes < 1440:
+            return f"{minutes // 60}h {minutes % 60}m"
+        return f"{minutes // 1440}d {minutes % 1440 // 60}h"
+
+    def sort_list(self, index):
+        meta = self.read_meta()
+        intervals = self.intervals()
+        now = time.time()
+        sort_name = sorted((name, index.count(name)) for name in index.feeds)
         for n, i in enumerate(sort_name, start=1):
+            entry = meta.get(i[0], {})
+            fetched = entry.get("fetched")
+            age = self.age(None if fetched is None else now - fetched)
+            # stale feeds are past their refresh interval
+            if fetched is None or now - fetched >= intervals.get(i[0], self.interval):
+                age = f"{Tc.yellow}{age}{Tc.rst}"
+            if entry.get("failed", 0) > (fetched or 0):
+                age += f" {Tc.gray}(failed {self.age(now - entry['failed'])} ago){Tc.rst}"
             try:
-                print(f"{Tc.cyan}{n:2}){Tc.rst} {i[0]:23}: {len(i[1]):<6,}")
+                print(f"{Tc.cyan}{n:2}){Tc.rst} {i[0]:23}: {i[1]:<9,} {age}")
             except TypeError:
-                print(f"{Tc.cyan}{n:2}){Tc.rst} {i[0]:23}: {Tc.gray}[DOWNLOAD error]{Tc.rst}")
+                print(f"{Tc.cyan}{n:2}){Tc.rst} {i[0]:23}: {Tc.gray}[DOWNLOAD error]{Tc.rst} {age}")
                 continue
 
     def list_count(self):
-        """ Returns a count of IP addresses for each feed """
+        """ Returns a count of IP addresses and the age of each feed """
         try:
-            with open(blklist) as json_file:
-                data = json.load(json_file)
+            with BlacklistIndex(blklist) as index:
                 self.clr_scrn()
-                print(f"\n{Tc.bold}{'Blacklists':28}IP cnt{Tc.rst}")
-                print("-" * 35)
-                self.sort_list(data)
+                print(f"\n{Tc.bold}{'Blacklists':28}{'IP cnt':10}Age{Tc.rst}")
+                print("-" * 50)
+                self.sort_list(index)
 
             print(f"\n{Tc.processing} Last Modified: {self.modified_date(blklist)}")
         except FileNotFoundError:
-            self.outdated()
+            print(Tc.missing)
+
+    def build_index(self, bl_dict):
+        """ Writes the blacklist index, and the bulk check prefilter for it unless fp_rate is 0 """
+        blindex.build(blklist, bl_dict)
+        if self.fp_rate:
+            feeds = list(bl_dict.values()) + list(self.read_scanners().values())
+            bloom.BloomFilter.build(feeds, self.fp_rate, bloom.identity(blklist, scnrs)).save(bloom_file)
+
+    def prefilter(self):
+        """ Returns the prefilter of the current index and scanner lists, or None if missing or stale """
+        try:
+            return bloom.BloomFilter.load(bloom_file, bloom.identity(blklist, scnrs))
+        except FileNotFoundError:
+            return None
 
     def update_list(self):
         """ Updates the feed list with latest IP addresses """
-        bl_dict = dict()
         print(f"{Tc.green}[ Updating ]{Tc.rst}")
-        with open(blklist, "w") as json_file:
-            bl_dict["Blacklists"] = {}
-            for name, url in self.read_list():
-                logger.success(f"  {Tc.processing} {name:20}")
-                bl_dict["Blacklists"][name] = self.get_feeds(url)
-
-            # Remove duplicate IP addresses and update
-            for name in bl_dict["Blacklists"]:
-                try:
-                    cleanup = list({ip for ip in bl_dict["Blacklists"][name]})
-                    bl_dict["Blacklists"].update({name: cleanup})
-                except TypeError:
-                    continue
 
-            json.dump(bl_dict, json_file, ensure_ascii=False, indent=4)
+        # reuse unchanged feeds from the current list
+        previous = self.read_index()
+
+        start = time.perf_counter()
+        bl_dict = self.get_feeds(self.read_list(), previous)
+        print(f"\n{Tc.processing} Downloaded {len(bl_dict)} feeds in {time.perf_counter() - start:.2f}s")
+
+        # as in refresh_due, a feed that fails to download keeps its previous IP addresses
+        for name, intervals in bl_dict.items():
+            if intervals is None:
+                bl_dict[name] = previous.get(name)
+
+        self.build_index(bl_dict)
+
+    def due_feeds(self, now=None):
+        """ Returns the (name, url) feeds whose refresh interval has passed """
+        now = now or time.time()
+        meta = self.read_meta()
+        intervals = self.intervals()
+        due = []
+        for name, url in self.read_list():
+            entry = meta.get(name, {})
+            interval = intervals[name]
+            if entry.get("url") != url:
+                due.append([name, url])
+            elif now - entry.get("fetched", 0) >= interval:
+                if now - entry.get("failed", 0) >= min(interval, RETRY_FAILED):
+                    due.append([name, url])
+        return due
+
+    def refresh_due(self):
+        """ Downloads only the feeds that are due and swaps in the rebuilt index, returns their names
+
+        A feed that fails to download keeps its previous IP addresses until the next attempt.
+        """
+        due = self.due_feeds()
+        if not due:
+            return []
+
+        previous = self.read_index()
+        refreshed = self.get_feeds(due, previous)
+        bl_dict = {name: previous.get(name) for name, _ in self.read_list()}
+        for name, intervals in refreshed.items():
+            if intervals is not None or bl_dict.get(name) is None:
+                bl_dict[name] = intervals
+
+        self.build_index(bl_dict)
+        return [name for name, _ in due]
 
     def add_feed(self, feed, url):
         """ Manually add feed """
@@ -158,44 +378,39 @@ class ProcessBL:
                 sys.exit(f'{Tc.warning} Feed "{feed}" already exists.')
         except KeyError:
             feed_list.update({feed: url})
-            with open(feeds, "w") as json_file:
+            with atomic_open(feeds) as json_file:
                 json.dump(feeds_dict, json_file, ensure_ascii=False, indent=4)
             print(f'[*] Added feed: "{feed}": "{url}"')
 
             print(f"\n{Tc.cyan}[ Updating new feed ]{Tc.rst}")
-            with open(blklist) as json_file:
-                bl_dict = json.load(json_file)
-                bl_list = bl_dict["Blacklists"]
-
-            bl_list.update({feed: self.get_feeds(url)})
-            with open(blklist, "w") as json_file:
-                json.dump(bl_dict, json_file, ensure_ascii=False, indent=4)
+            bl_list = self.read_index()
+            bl_list.update(self.get_feeds([[feed, url]]))
+            self.build_index(bl_list)
 
-            print(f"{Tc.success} {Tc.yellow}{len(bl_list[feed]):,}{Tc.rst} IPs added to '{feed}'")
+            print(f"{Tc.success} {Tc.yellow}{blindex.address_count(bl_list[feed]):,}{Tc.rst} IPs added to '{feed}'")
 
-    @staticmethod
-    def remove_feed():
+    def remove_feed(self):
         """ Remove a feed item """
         with open(feeds) as json_file:
             feeds_dict = json.load(json_file)
             feed_list = feeds_dict["Blacklist Feeds"]
             for n, (k, v) in enumerate(feed_list.items(), start=1):
-                print(f"{Tc.cyan}{n:2}){Tc.rst} {k:25}{v}")
+                print(f"{Tc.cyan}{n:2}){Tc.rst} {k:25}{self.feed_url(v)}")
         try:
             # remove from feeds
             opt = int(input("\nPlease select your choice by number, or Ctrl-C to cancel: "))
             opt = opt - 1  # subtract 1 as enumerate starts at 1
             choice = list(feed_list)[opt]
             del feed_list[choice]
-            with open(feeds, "w") as json_file:
+            with atomic_open(feeds) as json_file:
                 json.dump(feeds_dict, json_file, ensure_ascii=False, indent=4)
 
             # remove from blacklist
-            with open(blklist) as json_file:
-                bl_dict = json.load(json_file)
-                del bl_dict["Blacklists"][choice]
-            with open(blklist, "w") as json_file:
-                json.dump(bl_dict, json_file, ensure_ascii=False, indent=4)
+            bl_list = self.read_index()
+            del bl_list[choice]
+            self.build_index(bl_list)
+            if self.store is not None:
+                self.store.remove(choice)
 
             print(f'{Tc.success} Successfully removed feed: "{choice}"')
 
@@ -204,51 +419,171 @@ class ProcessBL:
         except (IndexError, ValueError, KeyError):
             sys.exit(f"{Tc.error} Your selection does not exist.")
 
-    def ip_matches(self, ip_addrs):
-        found = []
-        qf = ContactFinder()
+    def find_contacts(self, ip_addr):
+        """ Returns the abuse contacts for the IP address """
+        from dns.exception import DNSException
 
-        def worker(json_list, list_name, list_type):
-            global name, ip
-            with open(json_list) as json_file:
-                ip_list = json.load(json_file)
+        if self.qf is None:
+            from querycontacts import ContactFinder
 
-            for name, item in ip_list[list_name].items():
+            self.qf = ContactFinder()
+        try:
+            return [str(i) for i in self.qf.find(ip_addr)]
+        except DNSException:
+            return None
+
+    def enrich(self, ip_addr):
+        """ Returns the location, whois and abuse contacts for the IP address, cached per source """
+        return self.enrich_all([ip_addr])[ip_addr]
+
+    def enrich_all(self, ip_addrs):
+        """ Returns the location, whois and abuse contacts for each distinct IP, looked up concurrently """
+        sources = (("geo", self.geo_locate), ("whois", self.whois_ip), ("contact", self.find_contacts))
+        distinct = list(dict.fromkeys(ip_addrs))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            jobs = {
+                (ip, source): executor.submit(self.cache.get_or_fetch, source, ip, func)
+                for ip in distinct
+                for source, func in sources
+            }
+
+        enriched = {}
+        for ip in distinct:
+            results = []
+            for source, _ in sources:
                 try:
-                    matches = set(ip_addrs) & set(item)
-                    for ip in matches:
-                        print(f"\n{list_type} [{ip}] > {Tc.yellow}{name}{Tc.rst}")
-                        print(f"{Tc.bold}{'   Location:':10} {Tc.rst}{self.geo_locate(ip)}{Tc.bold}")
-                        print(f"{Tc.bold}{'   Whois:':10} {Tc.rst}{self.whois_ip(ip)}")
-                        try:
-                            print(f"{Tc.bold}{'   Contact:':10} {Tc.rst}{' '.join([str(i) for i in qf.find(ip)])}\n")
-                        except DNSException:
-                            pass
-                        if ip not in found:
-                            found.append(ip)
-                except ValueError:
-                    print(f"{Tc.warning} {'INVALID IP':12} {ip}")
-                except TypeError:
-                    continue
+                    results.append(jobs[(ip, source)].result())
+                except Exception:
+                    results.append(None)
+            enriched[ip] = tuple(results)
+        self.cache.save()
+        return enriched
 
-        # Compare and find blacklist matches
-        worker(blklist, "Blacklists", Tc.blacklisted)
+    @staticmethod
+    def print_enrichment(location, whois, contacts):
+        print(f"{Tc.bold}{'   Location:':10} {Tc.rst}{location}{Tc.bold}")
+        print(f"{Tc.bold}{'   Whois:':10} {Tc.rst}{'No results' if whois is None else whois}")
+        if contacts is not None:
+            print(f"{Tc.bold}{'   Contact:':10} {Tc.rst}{' '.join(contacts)}\n")
+
+    def check_chunks(self, ip_addrs, enrich=True, chunk_size=1000, prefilter=False):
+        """ Yields a list of result records (see utils.records) for each chunk of IPs, in input order
+
+        IPs are matched in batches of at least batchmatch.BATCH_THRESHOLD, so the
+        NumPy matcher is used for large inputs, then enriched and yielded
+        chunk_size at a time. With prefilter, IPs rejected by the index's Bloom
+        filter skip the exact lookup.
+        """
+        scanners = self.read_scanners()
+        bloom_filter = self.prefilter() if prefilter else None
+        matchers = None
+        ip_addrs = iter(ip_addrs)
+
+        with BlacklistIndex(blklist) as index:
+
+            def batch_matchers():
+                # built once and shared by every chunk
+                nonlocal matchers
+                if matchers is None:
+                    matchers = (
+                        batchmatch.BatchMatcher.from_index(index),
+                        batchmatch.BatchMatcher.from_feeds(scanners),
+                    )
+                return matchers
+
+            batch_size = max(chunk_size, batchmatch.BATCH_THRESHOLD)
+            while True:
+                batch = list(islice(ip_addrs, batch_size))
+                if not batch:
+                    break
+                matched = records.match_records(index, scanners, batch, batch_matchers, bloom_filter)
+                for pos in range(0, len(matched), chunk_size):
+                    results = matched[pos : pos + chunk_size]
+                    if enrich:
+                        valid = [record for record in results if "error" not in record]
+                        enriched = self.enrich_all([record["ip"] for record in valid])
+                        for record in valid:
+                            location, whois, contacts = enriched[record["ip"]]
+                            record.update(location=location, whois=whois, contacts=contacts)
+                    yield results
+
+    @staticmethod
+    def read_ips(lines):
+        """ Yields the first field of each line, skipping blank lines and comments """
+        for line in lines:
+            fields = line.replace(",", " ").split()
+            if fields and not fields[0].startswith("#"):
+                yield fields[0]
 
-        # Compare and find scanner matches
+    def ip_matches(self, ip_addrs):
+        results = [record for chunk in self.check_chunks(ip_addrs) for record in chunk]
+        checked = [record for record in results if "error" not in record]
+
+        for record in results:
+            if "error" in record:
+                print(f"{Tc.warning} {'INVALID IP':12} {record['ip']}")
+
+        # Blacklist matches, then scanner matches
         # ref: https://wiki.ipfire.org/configuration/firewall/blockshodan
-        worker(scnrs, "Scanners", Tc.scanner)
+        for field, list_type in (("blacklists", Tc.blacklisted), ("scanners", Tc.scanner)):
+            for record in checked:
+                for name in record[field]:
+                    print(f"\n{list_type} [{record['ip']}] > {Tc.yellow}{name}{Tc.rst}")
+                    self.print_enrichment(record["location"], record["whois"], record["contacts"])
 
         # if not blacklisted
-        nomatch = [ip for ip in ip_addrs if ip not in found]
-        if nomatch:
-            for ip in nomatch:
-                print(f"\n{Tc.clean}{Tc.rst} [{ip}]")
-                print(f"{Tc.bold}{'   Location:':10} {Tc.rst}{self.geo_locate(ip)}{Tc.bold}")
-                print(f"{Tc.bold}{'   Whois:':10} {Tc.rst}{self.whois_ip(ip)}")
-                try:
-                    print(f"{Tc.bold}{'   Contact:':10} {Tc.rst}{' '.join([str(i) for i in qf.find(ip)])}\n")
-                except DNSException:
-                    pass
+        for record in checked:
+            if not record["listed"]:
+                print(f"\n{Tc.clean}{Tc.rst} [{record['ip']}]")
+                self.print_enrichment(record["location"], record["whois"], record["contacts"])
+
+    def bulk_matches(self, infile, outfile=sys.stdout, chunk_size=10000):
+        """ Streams IPs from infile in chunks and writes each listed IP with its feeds """
+        checked = listed = invalid = 0
+        start = time.perf_counter()
+
+        for chunk in self.check_chunks(self.read_ips(infile), enrich=False, chunk_size=chunk_size, prefilter=True):
+            lines = []
+            for record in chunk:
+                if "error" in record:
+                    invalid += 1
+                else:
+                    checked += 1
+                    listed += record["listed"]
+                    if record["listed"]:
+                        lines.append(f"{record['ip']}\t{', '.join(record['blacklists'] + record['scanners'])}\n")
+
+            outfile.writelines(lines)
+            outfile.flush()
+
+        print(
+            f"\n{Tc.processing} Checked {checked:,} IPs in {time.perf_counter() - start:.2f}s: "
+            f"{listed:,} listed, {invalid:,} invalid",
+            file=sys.stderr,
+        )
+
+    @staticmethod
+    def read_scanners():
+        """ Returns the merged intervals for each scanner list """
+        with open(scnrs) as json_file:
+            scanners = json.load(json_file)["Scanners"]
+        return {name: feedparsers.parse(item, "plain") for name, item in scanners.items()}
+
+    def ip_history(self, ip_addrs):
+        """ Prints when each feed first and last listed the IP addresses """
+        for ip in ip_addrs:
+            print(f"\n{Tc.bold}[{ip}]{Tc.rst}")
+            entries = self.store.history(ip)
+            if not entries:
+                print(Tc.clean)
+                continue
+            print(f"{Tc.bold}   {'Feed':25}{'First seen':18}{'Last seen':18}Status{Tc.rst}")
+            for entry in entries:
+                first = datetime.fromtimestamp(entry["first_seen"]).strftime("%Y-%m-%d %H:%M")
+                last = datetime.fromtimestamp(entry["last_seen"]).strftime("%Y-%m-%d %H:%M")
+                status = f"{Tc.red}listed{Tc.rst}" if entry["listed"] else f"{Tc.gray}removed{Tc.rst}"
+                print(f"   {entry['feed']:25}{first:18}{last:18}{status} {Tc.gray}{entry['network']}{Tc.rst}")
 
     @staticmethod
     def modified_date(_file):
@@ -256,12 +591,11 @@ class ProcessBL:
         lastmod = os.stat(_file).st_mtime
         return datetime.strptime(time.ctime(lastmod), "%a %b %d %H:%M:%S %Y")
 
-    @staticmethod
-    def geo_locate(ip_addr):
+    def geo_locate(self, ip_addr):
         """ Returns IP address geolocation """
         try:
             url = f"https://freegeoip.live/json/{ip_addr}"
-            resp = requests.get(url)
+            resp = self.intel.get("geo", url)
             if resp.status_code == 200:
                 data = json.loads(resp.content.decode("utf-8"))
                 city = data["city"]
@@ -277,11 +611,13 @@ class ProcessBL:
             else:
                 resp.raise_for_status()
         except Exception as err:
-            print(f"[error] {err}\n")
+            logger.error(f"[error] {err}")
 
     @staticmethod
     def whois_ip(ip_addr):
         """ Returns IP address whois information """
+        from ipwhois import IPWhois, exceptions
+
         try:
             # ref: https://ipwhois.readthedocs.io/en/latest/RDAP.html
             obj = IPWhois(ip_addr)
@@ -289,63 +625,91 @@ class ProcessBL:
             return results["nets"][0]["description"]
             # results = obj.lookup_rdap(depth=1)
             # return results["network"]["name"]
-        except (exceptions.ASNRegistryError, exceptions.WhoisLookupError):
+        except exceptions.IPDefinedError:
+            # private and reserved addresses have no registry entry
             return "No results"
+        except (exceptions.ASNRegistryError, exceptions.WhoisLookupError):
+            # also raised for network and registry failures, so the result is not cached
+            return None
         except Exception as err:
-            return err
+            logger.error(f"[error] {err}")
+
+    def outdated(self):
+        """ Checks if any feed is due for a refresh """
+        return bool(self.due_feeds())
+
+    def ip46_base(self, ip_addr):
+        """ Returns the IP-46 report page, or None if it could not be fetched """
+        import requests
 
-    @staticmethod
-    def outdated():
-        """ Checks if feed list is outdated (within last 24 hours) """
         try:
-            file_time = os.path.getmtime(blklist)
-            if (time.time() - file_time) / 3600 > 24:
-                return True
-        except Exception as e:
-            sys.exit(e)
-        else:
-            return False
+            resp = self.intel.get("ip46", f"https://ip-46.com/{ip_addr}")
+        except requests.exceptions.RequestException:
+            return None
+        if resp.status_code == 200:
+            return resp.text
 
-    @staticmethod
-    def ip46_qry(ip_addr):
-        ip_addr = "".join(ip_addr)
-        url = f"https://ip-46.com/{ip_addr}"
-        r = requests.get(url)
-        soup = BeautifulSoup(r.text, features="lxml")
-        metadata = soup.find("meta")
+    def ip46_report(self, ip_addr):
+        """ Returns {"listed", "summary"} from the IP-46 report page, or None if it could not be fetched """
+        from bs4 import BeautifulSoup
 
+        page = self.ip46_base(ip_addr)
+        if page is None:
+            return None
+        soup = BeautifulSoup(page, features="lxml")
         detection = soup.title.get_text()
-        if "No abuse detected" not in detection:
-            print(". ".join(metadata["content"].split(". ")[0:2]).split("IP-46.com", 1)[0])
-            return detection
+        if "No abuse detected" in detection:
+            return {"listed": False, "summary": None}
+        metadata = soup.find("meta")
+        summary = ". ".join(metadata["content"].split(". ")[0:2]).split("IP-46.com", 1)[0]
+        return {"listed": True, "summary": summary}
+
+    def ip46_qry(self, ip_addr):
+        report = self.ip46_report(ip_addr)
+        if report is None:
+            print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{Tc.rst}")
+        elif report["listed"]:
+            print(report["summary"])
         else:
             print(Tc.clean)
 
-    @staticmethod
-    def urlhaus_base(ip_addr):
-        base_url = "https://urlhaus-api.abuse.ch/v1/host/"
-        resp = requests.post(base_url, data={"host": ip_addr})
+    def urlhaus_base(self, ip_addr):
+        """ Returns the URLhaus host report, or None if it could not be fetched """
+        import requests
 
+        base_url = "https://urlhaus-api.abuse.ch/v1/host/"
+        try:
+            resp = self.intel.post("urlhaus", base_url, data={"host": ip_addr})
+        except requests.exceptions.RequestException:
+            return None
         if resp.status_code == 200:
             return resp.json()
 
+    def urlhaus_report(self, ip_addr):
+        """ Returns {"listed", "urls"} from the URLhaus host report, or None if it could not be fetched """
+        report = self.urlhaus_base(ip_addr)
+        if report is None:
+            return None
+        if report["query_status"] == "no_results":
+            return {"listed": False, "urls": []}
+        urls = [
+            {"url": k["url"], "status": k["url_status"], "threat": k["threat"], "tags": k["tags"] or []}
+            for k in report.get("urls") or []
+        ]
+        return {"listed": True, "urls": urls}
+
     def urlhaus_qry(self, ip_addr):
-        if self.urlhaus_base(ip_addr)["query_status"] == "no_results":
+        report = self.urlhaus_report(ip_addr)
+        if report is None:
+            print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{Tc.rst}")
+        elif not report["listed"]:
             print(Tc.clean)
         else:
-            if self.urlhaus_base(ip_addr)["urls"]:
-                for k in self.urlhaus_base(ip_addr)["urls"]:
-                    if k["url_status"] == "online":
-                        print(f"Status: {Tc.red}{k['url_status'].title()}{Tc.rst}")
-                        print(f"{k['threat'].replace('_', ' ').title():12}: {k['url']}")
-                        if k["tags"]:
-                            print(f"Tags: {', '.join(k['tags'])}\n")
-                        else:
-                            print("\n")
-                    else:
-                        print(f"Status: {k['url_status'].title()}")
-                        print(f"{k['threat'].replace('_', ' ').title():12}: {k['url']}")
-                        if k["tags"]:
-                            print(f"Tags: {', '.join(k['tags'])}\n")
-                        else:
-                            print("\n")
+            for k in report["urls"]:
+                status = k["status"].title()
+                print(f"Status: {Tc.red}{status}{Tc.rst}" if k["status"] == "online" else f"Status: {status}")
+                print(f"{k['threat'].replace('_', ' ').title():12}: {k['url']}")
+                if k["tags"]:
+                    print(f"Tags: {', '.join(k['tags'])}\n")
+                else:
+                    print("\n")
@@ -0,0 +1,194 @@
+"""
+Embeddable blacklist checker, for calling the checks in-process instead of running the CLI.
+
+    from utils.checker import Checker
+
+    with Checker() as checker:
+        for result in checker.check_ips(["104.152.52.31", "2001:db8::1"], enrich=True):
+            if result.listed:
+                print(result.ip, result.blacklists)
+
+The index and scanner lists are loaded into memory once and shared by every call.
+Nothing is printed: failures raise CheckError subclasses (see utils.errors), and
+lookups that fail for a single IP leave its field None.
+"""
+import asyncio
+import os
+from pathlib import Path
+
+from utils import records
+from utils.blworker import ProcessBL, blklist
+from utils.errors import CheckError, IndexMissingError
+from utils.qryserver import Snapshot
+from utils.ratelimit import DEFAULT_LIMITS, Quota
+
+
+class CheckResult:
+    """ Result of one IP check, exposing the record fields (see utils.records) as attributes
+
+    Fields of checks that did not run are None.
+    """
+
+    __slots__ = ("record",)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getattr__(self, name):
+        if name in records.FIELDS:
+            return self.record.get(name)
+        raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self.record)
+
+    def __repr__(self):
+        return f"CheckResult({self.record!r})"
+
+
+class Checker:
+    """ Checks IPs against the blacklist index, loaded once and reused by every call
+
+    Optional checks run per call: `enrich` (location, whois, abuse contacts),
+    `dnsbl` (the RBL zones) and `intel` (VirusTotal and AbuseIPDB, for the
+    providers with an api key, paced by `quota`).
+    """
+
+    def __init__(
+        self,
+        index_path=None,
+        scanners=None,
+        cache=None,
+        intel=None,
+        workers=25,
+        virustotal_key=None,
+        abuseipdb_key=None,
+        quota=None,
+        dnsbl=None,
+    ):
+        self.index_path = Path(index_path or blklist)
+        self.pbl = ProcessBL(cache=cache, workers=workers, intel=intel)
+        self.scanners = self.pbl.read_scanners() if scanners is None else scanners
+        self._dnsbl = dnsbl
+
+        self.quota = quota
+        if quota is None:
+            self.quota = Quota()
+            for provider, (per_minute, per_day) in DEFAULT_LIMITS.items():
+                self.quota.limit(provider, per_minute, 60)
+                self.quota.limit(provider, per_day, 86400)
+
+        self.virustotal = self.abuseipdb = None
+        if virustotal_key:
+            from utils.vtworker import VirusTotal
+
+            self.virustotal = VirusTotal(virustotal_key, intel=self.pbl.intel)
+        if abuseipdb_key:
+            from utils.aipdbworker import AbuseIPDB
+
+            self.abuseipdb = AbuseIPDB(abuseipdb_key, intel=self.pbl.intel)
+
+        self.snapshot = self.load()
+
+    def load(self):
+        try:
+            return Snapshot(self.index_path, self.scanners)
+        except FileNotFoundError:
+            raise IndexMissingError(f"Blacklist index missing: {self.index_path} -- run 'blacklist_check.py -u'")
+        except ValueError as err:
+            raise CheckError(str(err))
+
+    def reload(self):
+        """ Loads the index again if the file changed, returns True if it was reloaded """
+        try:
+            mtime = os.stat(self.index_path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.snapshot.mtime:
+            return False
+        # swapped by reference, so calls in flight finish on the snapshot they started with
+        self.snapshot = self.load()
+        return True
+
+    @property
+    def dnsbl(self):
+        if self._dnsbl is None:
+            from utils.dnsblworker import DNSBL
+
+            self._dnsbl = DNSBL()
+        return self._dnsbl
+
+    # ---[ Checks ]---
+    def _match(self, ip_addrs):
+        # intel responses are shared within a call, enrichment results are kept for their TTL
+        self.pbl.intel.reset()
+        results = self.snapshot.check(list(ip_addrs))
+        return results, [record for record in results if "error" not in record]
+
+    def _enrich(self, valid):
+        enriched = self.pbl.enrich_all([record["ip"] for record in valid])
+        for record in valid:
+            location, whois, contacts = enriched[record["ip"]]
+            record.update(location=location, whois=whois, contacts=contacts)
+
+    def _add_dnsbl(self, valid, listed):
+        for record in valid:
+            record["dnsbl"] = listed.get(record["ip"], {})
+
+    def _intel(self, valid):
+        cache = self.pbl.cache
+        for record in valid:
+            if self.virustotal:
+                record["virustotal"] = self.virustotal.vt_record(
+                    self.virustotal.vt_cached(record["ip"], cache, self.quota)
+                )
+            if self.abuseipdb:
+                record["abuseipdb"] = self.abuseipdb.aipdb_record(
+                    self.abuseipdb.aipdb_cached(record["ip"], cache, self.quota)
+                )
+
+    def check_ips(self, ip_addrs, enrich=False, dnsbl=False, intel=False):
+        """ Returns a CheckResult for each IP, in input order """
+        results, valid = self._match(ip_addrs)
+        if enrich:
+            self._enrich(valid)
+        if dnsbl and valid:
+            self._add_dnsbl(valid, self.dnsbl.dnsbl_check([record["ip"] for record in valid]))
+        if intel:
+            self._intel(valid)
+        return [CheckResult(record) for record in results]
+
+    def check_ip(self, ip_addr, **options):
+        return self.check_ips([ip_addr], **options)[0]
+
+    async def check_ips_async(self, ip_addrs, enrich=False, dnsbl=False, intel=False):
+        """ check_ips for asyncio callers: blocking lookups run in the default executor, RBL queries on the loop """
+        loop = asyncio.get_running_loop()
+        results, valid = await loop.run_in_executor(None, self._match, list(ip_addrs))
+
+        async def rbl():
+            self._add_dnsbl(valid, await self.dnsbl.dnsbl_check_async([record["ip"] for record in valid]))
+
+        jobs = []
+        if enrich:
+            jobs.append(loop.run_in_executor(None, self._enrich, valid))
+        if dnsbl and valid:
+            jobs.append(rbl())
+        if intel:
+            jobs.append(loop.run_in_executor(None, self._intel, valid))
+        await asyncio.gather(*jobs)
+        return [CheckResult(record) for record in results]
+
+    async def check_ip_async(self, ip_addr, **options):
+        return (await self.check_ips_async([ip_addr], **options))[0]
+
+    def close(self):
+        self.snapshot.index.close()
+        self.pbl.cache.save()
+        self.pbl.intel.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,45 +1,95 @@
+import asyncio
 import json
-import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 from ipaddress import ip_address
 from pathlib import Path
 
-import coloredlogs
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
 import dns.resolver
-import requests
-import verboselogs
-from bs4 import BeautifulSoup
 
+from utils import logsetup
+from utils.atomicfile import atomic_open
+from utils.dnscache import DNSCache
 from utils.termcolors import Termcolor as Tc
+from utils.zonehealth import ZoneHealth
 
-logger = verboselogs.VerboseLogger(__name__)
-logger.setLevel(logging.INFO)
-coloredlogs.install(
-    level="DEBUG",
-    logger=logger,
-    fmt="%(message)s",
-    level_styles={
-        "notice": {"color": "black", "bright": True},
-        "warning": {"color": "yellow"},
-        "success": {"color": "white", "bold": True},
-        "error": {"color": "red"},
-        "critical": {"background": "red"},
-    },
-)
+logger = logsetup.get_logger(__name__)
 
 # Base directory
 parent = Path(__file__).resolve().parent.parent
 feeds = parent.joinpath("resc/feeds.json")
+dns_db = parent.joinpath("resc/dnsbl_cache.db")
+
+# seconds to cache a negative answer when the response carries no SOA
+NEGATIVE_TTL = 300
+
+# Return Codes
+CODES = {
+    "0.0.0.1",
+    "127.0.0.1",
+    "127.0.0.2",
+    "127.0.0.3",
+    "127.0.0.4",
+    "127.0.0.5",
+    "127.0.0.6",
+    "127.0.0.7",
+    "127.0.0.9",
+    "127.0.0.10",
+    "127.0.0.11",
+    "127.0.0.39",
+    "127.0.0.45",
+    "127.0.1.4",
+    "127.0.1.5",
+    "127.0.1.6",
+    "127.0.1.20",
+    "127.0.1.103",
+    "127.0.1.104",
+    "127.0.1.105",
+    "127.0.1.106",
+    "127.0.1.108",
+    "10.0.2.3",
+}
 
 
 class DNSBL:
-    def __init__(self, host, threads):
+    def __init__(self, host=None, concurrency=100, timeout=3, nameservers=None, port=53, cache=None, health=None):
         self.host = host
-        self.threads = threads
-        self.cnt = 0
+        self.cache = cache or DNSCache(dns_db)
+        self._health = health
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.nameservers = nameservers
+        self.port = port
+        self.skipped = set()
+        self._resolver = None
+
+    @property
+    def resolver(self):
+        """ Shared async resolver, configured once from resolv.conf or the given nameservers """
+        if self._resolver is None:
+            self._resolver = dns.asyncresolver.Resolver(configure=not self.nameservers)
+            if self.nameservers:
+                self._resolver.nameservers = self.nameservers
+                self._resolver.port = self.port
+            self._resolver.timeout = self.timeout
+            self._resolver.lifetime = self.timeout
+        return self._resolver
+
+    @property
+    def health(self):
+        """ Zone health history, loaded on first use """
+        if self._health is None:
+            self._health = ZoneHealth(dns_db)
+        return self._health
 
     @staticmethod
     def update_dnsbl():
+        import requests
+        from bs4 import BeautifulSoup
+
+        logsetup.install(logger)
         url = "http://multirbl.valli.org/list/"
         page = requests.get(url).text
         soup = BeautifulSoup(page, "html.parser")
@@ -70,87 +120,145 @@ class DNSBL:
                     logger.success(f"[+] Adding {item}")
                     feed_list.append(item)
 
-            with open(feeds, "w") as json_file:
+            with atomic_open(feeds) as json_file:
                 json.dump(feeds_dict, json_file, ensure_ascii=False, indent=4)
         else:
             return False
 
     @staticmethod
-    def resolve_dns(qry):
-        try:
-            resolver = dns.resolver.Resolver()
-            resolver.timeout = 3
-            resolver.lifetime = 3
-            answer = resolver.resolve(qry, "A")
-
-            return answer
-
-        except (
-            dns.resolver.NXDOMAIN,
-            dns.resolver.Timeout,
-            dns.resolver.NoNameservers,
-            dns.resolver.NoAnswer,
-        ):
-            pass
-        except DeprecationWarning:
-            pass
-
-    def dnsbl_query(self, blacklist):
-        host = str("".join(self.host))
-
-        # Return Codes
-        codes = [
-            "0.0.0.1",
-            "127.0.0.1",
-            "127.0.0.2",
-            "127.0.0.3",
-            "127.0.0.4",
-            "127.0.0.5",
-            "127.0.0.6",
-            "127.0.0.7",
-            "127.0.0.9",
-            "127.0.0.10",
-            "127.0.0.11",
-            "127.0.0.39",
-            "127.0.0.45",
-            "127.0.1.4",
-            "127.0.1.5",
-            "127.0.1.6",
-            "127.0.1.20",
-            "127.0.1.103",
-            "127.0.1.104",
-            "127.0.1.105",
-            "127.0.1.106",
-            "127.0.1.108",
-            "10.0.2.3",
-        ]
+    def negative_ttl(response):
+        """ Returns the negative caching TTL from the SOA in the authority section """
+        for rrset in getattr(response, "authority", ()):
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum)
+        return NEGATIVE_TTL
 
+    async def resolve_dns(self, qry, zone=None, outcomes=None):
+        """ Returns the A record addresses for the name, or None if it does not exist
+
+        With a zone, the query's latency or failure is added to `outcomes`, a
+        {zone: [latencies, timeouts, errors]} dict recorded by ZoneHealth.record_run.
+        """
+        hit, addrs = self.cache.get(qry)
+        if hit:
+            return addrs
+
+        outcome = outcomes.setdefault(zone, [[], 0, 0]) if zone and outcomes is not None else None
+        timeout = self.health.timeout(zone, self.timeout) if zone else self.timeout
+        start = time.perf_counter()
         try:
-            qry = ip_address(host).reverse_pointer.replace(".in-addr.arpa", "") + "." + blacklist
-        except Exception:
-            qry = host + "." + blacklist
+            answer = await asyncio.wait_for(self.resolver.resolve(qry, "A"), timeout=timeout)
+        except dns.resolver.NXDOMAIN as exc:
+            responses = list(exc.responses().values())
+            self.cache.set(qry, None, self.negative_ttl(responses[0] if responses else None))
+        except dns.resolver.NoAnswer as exc:
+            self.cache.set(qry, None, self.negative_ttl(exc.response()))
+        except (asyncio.TimeoutError, dns.exception.Timeout):
+            if outcome is not None:
+                outcome[1] += 1
+            return None
+        except dns.resolver.NoNameservers:
+            if outcome is not None:
+                outcome[2] += 1
+            return None
+        else:
+            addrs = [str(rdata) for rdata in answer]
+            self.cache.set(qry, addrs, answer.rrset.ttl)
 
-        answer = self.resolve_dns(qry)
+        # any answer, including a negative one, means the zone is alive
+        if outcome is not None:
+            outcome[0].append(time.perf_counter() - start)
+        return addrs
+
+    @staticmethod
+    def dnsbl_name(host, blacklist):
+        """ Returns the query name of the host within the blacklist zone """
         try:
-            if any(str(answer[0]) in s for s in codes):
-                logger.success(f"{Tc.red}\u2716{Tc.rst}  Blacklisted > {blacklist}")
-                self.cnt += 1
-        except Exception:
-            pass
+            addr = ip_address(host)
+        except ValueError:
+            return host + "." + blacklist
+        addr = getattr(addr, "ipv4_mapped", None) or addr
+        # reversed octets (IPv4) or nibbles (IPv6) without the in-addr.arpa / ip6.arpa suffix
+        return addr.reverse_pointer.rsplit(".", 2)[0] + "." + blacklist
 
-    def dnsbl_mapper(self, threads=None):
+    async def dnsbl_query(self, host, blacklist, results, outcomes=None):
+        if self.health.is_dead(blacklist):
+            self.skipped.add(blacklist)
+            return
+        addrs = await self.resolve_dns(self.dnsbl_name(host, blacklist), blacklist, outcomes)
+        if addrs:
+            code = addrs[0]
+            if code in CODES:
+                results[host][blacklist] = code
+
+    async def dnsbl_worker(self, jobs, results, outcomes):
+        for host, url in jobs:
+            try:
+                await self.dnsbl_query(host, url, results, outcomes)
+            except Exception as exc:
+                logger.error(f"Exception generated: {host} {url} {exc}")
+
+    async def dnsbl_run(self, hosts, dnsbl):
+        """ Queries every host x zone pair, with at most 'concurrency' queries in flight """
+        results = {host: {} for host in hosts}
+        outcomes = {}
+        self.skipped = set()
+
+        # workers share one job iterator, so memory stays flat for large batches
+        jobs = ((host, url) for host in results for url in dnsbl)
+        workers = min(self.concurrency, len(results) * len(dnsbl))
+        await asyncio.gather(*(self.dnsbl_worker(jobs, results, outcomes) for _ in range(workers)))
+        if not self.health.record_run(outcomes):
+            logger.error(f"{len(outcomes)} RBL zones failed together, check the DNS resolver")
+        return results
+
+    @staticmethod
+    def read_dnsbl():
         with open(feeds) as json_file:
             data = json.load(json_file)
-        dnsbl = [url for url in data["DNS Blacklists"]["DNSBL"]]
-
-        with ThreadPoolExecutor(max_workers=threads) as executor:
-            dnsbl_map = {executor.submit(self.dnsbl_query, url): url for url in dnsbl}
-            for future in as_completed(dnsbl_map):
-                url = dnsbl_map[future]
-                try:
-                    future.result()
-                except Exception as exc:
-                    print(f"Exception generated: {url} {exc}")
-            if self.cnt:
-                host = str("".join(self.host))
-                logger.warning(f"\n[*] {host} is listed in {self.cnt} block lists")
+        return [url for url in data["DNS Blacklists"]["DNSBL"]]
+
+    def dnsbl_check(self, hosts=None):
+        """ Returns a dict of host and {zone: return code} for each zone listing it """
+        return asyncio.run(self.dnsbl_check_async(hosts))
+
+    async def dnsbl_check_async(self, hosts=None):
+        """ dnsbl_check for callers already running an event loop """
+        try:
+            return await self.dnsbl_run(hosts or self.host or [], self.read_dnsbl())
+        finally:
+            self.cache.save()
+            self.health.save()
+
+    def dnsbl_mapper(self, hosts=None):
+        logsetup.install(logger)
+        results = self.dnsbl_check(hosts)
+        for host, listed in results.items():
+            if len(results) > 1:
+                print(f"\n{Tc.bold}[{host}]{Tc.rst}")
+            for zone in sorted(listed):
+                logger.success(f"{Tc.red}\u2716{Tc.rst}  Blacklisted > {zone} {Tc.gray}({listed[zone]}){Tc.rst}")
+            if listed:
+                logger.warning(f"\n[*] {host} is listed in {len(listed)} block lists")
+            elif len(results) > 1:
+                print(Tc.clean)
+        print(f"\n{Tc.gray}RBL cache: {self.cache.hits:,} hits, {self.cache.misses:,} misses{Tc.rst}")
+        if self.skipped:
+            print(f"{Tc.gray}Skipped {len(self.skipped)} unresponsive zones, see -z for details{Tc.rst}")
+        return results
+
+    def zone_report(self):
+        """ Prints the zones that time out or fail, dead zones first """
+        report = self.health.report()
+        if not report:
+            print(f"{Tc.success} No failing RBL zones recorded")
+            return
+
+        print(f"\n{Tc.bold}{'Zone':40}{'Queries':>9}{'Timeouts':>10}{'Errors':>8}{'Latency':>9}  Status{Tc.rst}")
+        print("-" * 86)
+        for zone, stats in report:
+            latency = "-" if stats["latency"] is None else f"{stats['latency']:.2f}s"
+            status = f"{Tc.red}skipped{Tc.rst}" if self.health.is_dead(zone) else "active"
+            print(
+                f"{zone:40}{stats['queries']:>9,}{stats['timeouts']:>10,}{stats['errors']:>8,}{latency:>9}  {status}"
+            )
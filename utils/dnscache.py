@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+
+
+class DNSCache:
+    """ DNSBL answer cache honoring record TTLs, kept in memory and persisted to SQLite
+
+    A cached value is the list of A record addresses, or None for a negative
+    (NXDOMAIN / no answer) response.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._pending = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None and self.path:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS answers (name TEXT PRIMARY KEY, addrs TEXT, expires REAL)")
+        return self._conn
+
+    def get(self, name):
+        """ Returns (True, value) for an unexpired entry, otherwise (False, None) """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(name)
+            if entry is None and self._connect():
+                row = self._conn.execute("SELECT addrs, expires FROM answers WHERE name = ?", (name,)).fetchone()
+                if row:
+                    entry = (row[1], None if row[0] is None else row[0].split())
+                    self._memory[name] = entry
+
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, name, addrs, ttl):
+        if ttl <= 0:
+            return
+        entry = (time.time() + ttl, addrs)
+        with self._lock:
+            self._memory[name] = entry
+            self._pending[name] = entry
+
+    def save(self):
+        """ Writes new entries to disk and drops expired ones, also from memory """
+        now = time.time()
+        with self._lock:
+            self._memory = {name: entry for name, entry in self._memory.items() if entry[0] > now}
+            if not self._connect():
+                return
+            rows = [
+                (name, None if addrs is None else " ".join(addrs), expires)
+                for name, (expires, addrs) in self._pending.items()
+            ]
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", rows)
+                self._conn.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+            self._pending.clear()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# seconds each enrichment source stays fresh
+DEFAULT_TTLS = {"geo": 604800, "whois": 604800, "contact": 86400, "virustotal": 86400, "abuseipdb": 86400}
+
+# new entries and access times are written once this many are pending, or this many seconds passed
+SAVE_EVERY = 100
+SAVE_INTERVAL = 5
+
+
+class EnrichCache:
+    """ Persistent IP enrichment cache with a TTL per source and an LRU size bound
+
+    Recent entries are also kept in memory, in an LRU memo of memo_entries
+    that honors the same TTLs. Sources without a TTL are only memoized, until
+    reset(). New entries and access times are written in batches, by save()
+    or as they accumulate; close() writes the rest.
+    """
+
+    def __init__(self, path, ttls=None, max_entries=50000, memo_entries=10000):
+        self.path = path
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self.memo_entries = memo_entries
+        self.memo = OrderedDict()
+        self._pending = {}
+        self._accessed = {}
+        self._saved = time.time()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "source TEXT, ip TEXT, value TEXT, stored REAL, accessed REAL, PRIMARY KEY (source, ip))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        return self._conn
+
+    def get(self, source, ip):
+        """ Returns (True, value) for a fresh entry, otherwise (False, None) """
+        key = (source, ip)
+        ttl = self.ttls.get(source, 0)
+        now = time.time()
+        with self._lock:
+            entry = self.memo.get(key)
+            if entry is not None:
+                if ttl <= 0 or now - entry[0] <= ttl:
+                    self.memo.move_to_end(key)
+                    return True, entry[1]
+                del self.memo[key]
+
+            row = self._pending.get(key)
+            if row is None:
+                conn = self._connect()
+                row = conn.execute("SELECT value, stored FROM cache WHERE source = ? AND ip = ?", key).fetchone()
+            if row is None or now - row[1] > ttl:
+                return False, None
+            self._accessed[key] = now
+
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+        return True, value
+
+    def _remember(self, key, stored, value):
+        self.memo[key] = (stored, value)
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.memo_entries:
+            self.memo.popitem(last=False)
+
+    def set(self, source, ip, value):
+        now = time.time()
+        with self._lock:
+            self._remember((source, ip), now, value)
+            if self.ttls.get(source, 0) <= 0:
+                return
+            self._pending[(source, ip)] = (json.dumps(value), now)
+            if len(self._pending) >= SAVE_EVERY or now - self._saved >= SAVE_INTERVAL:
+                self._save(now)
+
+    def get_or_fetch(self, source, ip, func):
+        """ Returns the cached value, or calls func(ip) and caches its result unless it is None """
+        hit, value = self.get(source, ip)
+        if hit:
+            return value
+        value = func(ip)
+        if value is not None:
+            self.set(source, ip, value)
+        return value
+
+    def save(self):
+        """ Writes the pending entries and access times in one transaction """
+        with self._lock:
+            self._save(time.time())
+
+    def _save(self, now):
+        self._saved = now
+        if not (self._pending or self._accessed):
+            return
+        rows = [
+            (source, ip, value, stored, self._accessed.pop((source, ip), stored))
+            for (source, ip), (value, stored) in self._pending.items()
+        ]
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "UPDATE cache SET accessed = ? WHERE source = ? AND ip = ?",
+                ((accessed, *key) for key, accessed in self._accessed.items()),
+            )
+            # evict the least recently used entries, only once above the size bound
+            if conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] > self.max_entries:
+                conn.execute(
+                    "DELETE FROM cache WHERE rowid IN "
+                    "(SELECT rowid FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        self._pending.clear()
+        self._accessed.clear()
+
+    def reset(self):
+        """ Empties the memo, later lookups read the database again """
+        with self._lock:
+            self.memo.clear()
+
+    def close(self):
+        with self._lock:
+            self._save(time.time())
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
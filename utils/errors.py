@@ -0,0 +1,10 @@
+class CheckError(Exception):
+    """ Base class of the errors raised by the checker and the intel providers """
+
+
+class IndexMissingError(CheckError):
+    """ The blacklist index has not been downloaded yet """
+
+
+class ApiKeyError(CheckError):
+    """ An intel provider api key is missing or was rejected """
@@ -0,0 +1,160 @@
+"""
+Feed parsers, keyed by feed format.
+
+Each parser streams the feed line by line and yields (start, end) address
+key intervals (see blindex); every format accepts IPv4 and IPv6 addresses.
+A feed picks its format in resc/feeds.json, together with any parser
+option, e.g. {"url": "...", "format": "csv", "column": 2}; feeds without
+a format use the generic "regex" parser.
+
+    plain       one IP, CIDR block or range per line, '#' / ';' comments
+    ipset       FireHOL ipset / netset: one IP or CIDR block per line
+    csv         the IP in a CSV column (option: column, default 0)
+    snort       source and destination address lists of Snort / Suricata rules
+    alienvault  AlienVault reputation data (ip#risk#reliability#...)
+    regex       every IPv4 and IPv6 address found anywhere in the text
+"""
+import csv
+import re
+
+from utils import blindex
+
+PARSERS = {}
+
+# dotted quads not inside a longer dotted number, optionally followed by /prefix or -end
+_ipv4 = re.compile(
+    r"(?<![\d.])((?![0])\d+\.\d{1,3}\.\d{1,3}\.(\d{1,3}))"
+    r"(?:/(\d{1,2})(?![\d.])|-(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}))?"
+)
+# IPv6 candidates (hex groups with at least two colons and a digit), optionally followed by /prefix,
+# validated by inet_pton
+_ipv6 = re.compile(
+    r"(?<![\w:.])(?=[\w:.]*[1-9A-Fa-f])((?:[0-9A-Fa-f]{0,4}:){2,7}(?:[0-9A-Fa-f]{1,4}|[\d.]{7,15})?)"
+    r"(?:/(\d{1,3}))?(?![\w:]|\.\d)"
+)
+
+
+def register(name):
+    def decorator(func):
+        PARSERS[name] = func
+        return func
+
+    return decorator
+
+
+def to_interval(token):
+    """ Returns the (start, end) integers of an IP, CIDR block or 'start-end' range, or None if invalid """
+    if "/" in token:
+        addr, _, prefix = token.partition("/")
+        return blindex.cidr_to_range(addr, int(prefix)) if prefix.isdigit() else None
+    if "-" in token:
+        start, _, end = token.partition("-")
+        interval = (blindex.ip_to_int(start.strip()), blindex.ip_to_int(end.strip()))
+        return None if None in interval or interval[0] > interval[1] else interval
+    value = blindex.ip_to_int(token)
+    return None if value is None else (value, value)
+
+
+@register("plain")
+def parse_plain(lines):
+    for line in lines:
+        fields = line.split(None, 1)
+        if not fields or fields[0][0] in "#;":
+            continue
+        interval = to_interval(fields[0])
+        if interval:
+            yield interval
+
+
+@register("ipset")
+@register("netset")
+def parse_ipset(lines):
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        interval = to_interval(line)
+        if interval:
+            yield interval
+
+
+@register("csv")
+def parse_csv(lines, column=0):
+    rows = csv.reader(line for line in lines if not line.startswith("#"))
+    for row in rows:
+        if len(row) > column:
+            interval = to_interval(row[column].strip())
+            if interval:
+                yield interval
+
+
+@register("snort")
+def parse_snort(lines):
+    for line in lines:
+        fields = line.split(None, 6)
+        if len(fields) < 6 or line[0] == "#":
+            continue
+        # action proto src_addr src_port direction dst_addr ...
+        for addrs in (fields[2], fields[5]):
+            if addrs[0] in "$!" or addrs == "any":
+                continue
+            for token in addrs.strip("[]").split(","):
+                interval = to_interval(token)
+                if interval:
+                    yield interval
+
+
+@register("alienvault")
+def parse_alienvault(lines):
+    for line in lines:
+        interval = to_interval(line.partition("#")[0].strip())
+        if interval:
+            yield interval
+
+
+@register("regex")
+def parse_regex(lines):
+    for line in lines:
+        for match in _ipv4.finditer(line):
+            addr, last_octet, prefix, range_end = match.groups()
+            if prefix:
+                interval = blindex.cidr_to_range(addr, int(prefix))
+            elif range_end:
+                interval = (blindex.ip_to_int(addr), blindex.ip_to_int(range_end))
+                if None in interval or interval[0] > interval[1]:
+                    interval = None
+            elif last_octet.startswith("0"):
+                interval = None
+            else:
+                value = blindex.ip_to_int(addr)
+                interval = None if value is None else (value, value)
+            if interval:
+                yield interval
+        if ":" in line:
+            for match in _ipv6.finditer(line):
+                addr, prefix = match.groups()
+                if prefix:
+                    interval = blindex.cidr_to_range(addr, int(prefix))
+                else:
+                    value = blindex.ip_to_int(addr)
+                    interval = None if value is None else (value, value)
+                if interval:
+                    yield interval
+
+
+def entries(lines, fmt="regex", **options):
+    """ Returns the distinct (start, end) intervals of the feed lines as listed, sorted but not merged """
+    try:
+        parser = PARSERS[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown feed format: {fmt}")
+    return sorted(set(parser(lines, **options)))
+
+
+def parse(lines, fmt="regex", **options):
+    """ Returns the merged (start, end) intervals of the feed lines, parsed as the given format """
+    try:
+        parser = PARSERS[fmt]
+    except KeyError:
+        raise ValueError(f"Unknown feed format: {fmt}")
+    return blindex.merge(parser(lines, **options))
@@ -0,0 +1,159 @@
+import sqlite3
+import threading
+import time
+
+from utils import blindex
+
+# address keys are stored as fixed width big-endian blobs, which sort like the integers
+_KEY_BYTES = 17
+
+
+def _key(value):
+    return value.to_bytes(_KEY_BYTES, "big")
+
+
+def _value(key):
+    return int.from_bytes(key, "big")
+
+
+class FeedStore:
+    """ SQLite (WAL) history of the feed contents, with when each entry was first and last seen
+
+    Entries are the IPs, networks and ranges as the feed lists them, before
+    merging, so a neighbouring entry added later does not reset their history.
+    A refresh applies only the entries a feed added or dropped since the last
+    refresh; dropped entries are kept as history. Entries still listed were last
+    seen at their feed's last successful download.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # readers are not blocked while a refresh writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS feeds (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, "
+                "updated REAL, max_span BLOB)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (feed_id INTEGER NOT NULL, start BLOB NOT NULL, end BLOB NOT NULL, "
+                "first_seen REAL NOT NULL, last_seen REAL, listed INTEGER NOT NULL DEFAULT 1, "
+                "PRIMARY KEY (feed_id, start, end)) WITHOUT ROWID"
+            )
+        return self._conn
+
+    def _feed(self, conn, name):
+        """ Returns the id, last update and max entry span of a feed, adding it if new """
+        row = conn.execute("SELECT id, updated, max_span FROM feeds WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            cursor = conn.execute("INSERT INTO feeds (name, max_span) VALUES (?, ?)", (name, _key(0)))
+            return cursor.lastrowid, None, 0
+        return row[0], row[1], _value(row[2])
+
+    def _apply(self, conn, name, intervals, now):
+        feed_id, updated, max_span = self._feed(conn, name)
+        current = {
+            (_value(start), _value(end))
+            for start, end in conn.execute("SELECT start, end FROM entries WHERE feed_id = ? AND listed = 1", (feed_id,))
+        }
+        new = set(intervals)
+        added = new - current
+        dropped = current - new
+
+        conn.executemany(
+            "UPDATE entries SET listed = 0, last_seen = ? WHERE feed_id = ? AND start = ? AND end = ?",
+            ((updated or now, feed_id, _key(start), _key(end)) for start, end in dropped),
+        )
+        # entries listed again keep their first_seen
+        conn.executemany(
+            "INSERT INTO entries (feed_id, start, end, first_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (feed_id, start, end) DO UPDATE SET listed = 1, last_seen = NULL",
+            ((feed_id, _key(start), _key(end), now) for start, end in added),
+        )
+        max_span = max([max_span] + [end - start for start, end in added])
+        conn.execute("UPDATE feeds SET updated = ?, max_span = ? WHERE id = ?", (now, _key(max_span), feed_id))
+        return len(added), len(dropped)
+
+    def names(self):
+        """ Returns the names of the feeds in the store """
+        with self._lock:
+            return {name for name, in self._connect().execute("SELECT name FROM feeds")}
+
+    def apply(self, name, intervals, now=None):
+        """ Records the current entries of one feed, returns the number of added and dropped entries """
+        return self.sync({name: intervals}, now=now)[name]
+
+    def sync(self, feeds, changed=None, now=None):
+        """ Records the feeds of a refresh in one transaction, returns {name: (added, dropped)}
+
+        Feeds not in `changed` (e.g. not modified since the last download) only
+        update their last seen time, unless the store does not know them yet.
+        """
+        now = now or time.time()
+        counts = {}
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for name, intervals in feeds.items():
+                    if intervals is None:
+                        continue
+                    if changed is None or name in changed:
+                        counts[name] = self._apply(conn, name, intervals, now)
+                        continue
+                    cursor = conn.execute("UPDATE feeds SET updated = ? WHERE name = ?", (now, name))
+                    if not cursor.rowcount:
+                        counts[name] = self._apply(conn, name, intervals, now)
+        return counts
+
+    def remove(self, name):
+        """ Deletes a feed and its history """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT id FROM feeds WHERE name = ?", (name,)).fetchone()
+                if row:
+                    conn.execute("DELETE FROM entries WHERE feed_id = ?", row)
+                    conn.execute("DELETE FROM feeds WHERE id = ?", row)
+
+    def history(self, ip_addr):
+        """ Returns a dict (feed, network, first_seen, last_seen, listed) for each feed entry that covered the IP """
+        value = blindex.ip_to_int(ip_addr)
+        if value is None:
+            return []
+        results = []
+        with self._lock:
+            conn = self._connect()
+            feeds = conn.execute("SELECT id, name, updated, max_span FROM feeds ORDER BY name").fetchall()
+            for feed_id, name, updated, max_span in feeds:
+                # within a feed, only entries starting at most max_span below the IP can cover it
+                rows = conn.execute(
+                    "SELECT start, end, first_seen, last_seen, listed FROM entries "
+                    "WHERE feed_id = ? AND start BETWEEN ? AND ? AND end >= ? ORDER BY first_seen",
+                    (feed_id, _key(max(0, value - _value(max_span))), _key(value), _key(value)),
+                )
+                for start, end, first_seen, last_seen, listed in rows:
+                    start, end = _value(start), _value(end)
+                    network = blindex.int_to_ip(start)
+                    if end != start:
+                        network += f"-{blindex.int_to_ip(end)}"
+                    results.append(
+                        {
+                            "feed": name,
+                            "network": network,
+                            "first_seen": first_seen,
+                            "last_seen": updated if listed else last_seen,
+                            "listed": bool(listed),
+                        }
+                    )
+        return results
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
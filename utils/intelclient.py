@@ -0,0 +1,91 @@
+import json
+import threading
+from concurrent.futures import Future
+
+
+class IntelClient:
+    """ Keep-alive session per intel provider, with retry/backoff and request dedup
+
+    Responses are shared with identical requests until reset(); at most
+    memo_entries of them are kept, oldest dropped first.
+
+    requests is imported with the first session, so runs without intel lookups skip it.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, timeout=10, memo_entries=1000):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.memo_entries = memo_entries
+        self._sessions = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def session(self, provider):
+        with self._lock:
+            if provider not in self._sessions:
+                import requests
+                import urllib3
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                # suppress certificate verification
+                urllib3.disable_warnings()
+                options = dict(
+                    total=self.retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    raise_on_status=False,
+                )
+                # retry every method, including POST
+                try:
+                    retry = Retry(allowed_methods=None, **options)
+                except TypeError:
+                    # urllib3 < 1.26
+                    retry = Retry(method_whitelist=False, **options)
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(max_retries=retry))
+                session.mount("http://", HTTPAdapter(max_retries=retry))
+                self._sessions[provider] = session
+            return self._sessions[provider]
+
+    def request(self, provider, method, url, **kwargs):
+        """ Returns the response, sharing it with identical requests made earlier or concurrently """
+        key = (provider, method, url, json.dumps(kwargs, sort_keys=True, default=str))
+        with self._lock:
+            future = self._memo.get(key)
+            owner = future is None
+            if owner:
+                future = self._memo[key] = Future()
+                # callers already waiting on a dropped response keep their future
+                while len(self._memo) > self.memo_entries:
+                    del self._memo[next(iter(self._memo))]
+
+        if owner:
+            kwargs.setdefault("timeout", self.timeout)
+            try:
+                future.set_result(self.session(provider).request(method, url, **kwargs))
+            except Exception as exc:
+                # failed requests are not shared, so a later call can retry
+                with self._lock:
+                    if self._memo.get(key) is future:
+                        del self._memo[key]
+                future.set_exception(exc)
+        return future.result()
+
+    def get(self, provider, url, **kwargs):
+        return self.request(provider, "GET", url, **kwargs)
+
+    def post(self, provider, url, **kwargs):
+        return self.request(provider, "POST", url, **kwargs)
+
+    def reset(self):
+        """ Forgets the shared responses, so later requests are sent again """
+        with self._lock:
+            self._memo.clear()
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+        self._memo.clear()
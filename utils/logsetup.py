@@ -0,0 +1,32 @@
+import logging
+
+import verboselogs
+
+_installed = set()
+
+
+def get_logger(name):
+    logger = verboselogs.VerboseLogger(name)
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def install(logger):
+    """ Installs the colored console handler on logger, once and only when it is first needed """
+    if logger.name in _installed:
+        return
+    import coloredlogs
+
+    coloredlogs.install(
+        level="DEBUG",
+        logger=logger,
+        fmt="%(message)s",
+        level_styles={
+            "notice": {"color": "black", "bright": True},
+            "warning": {"color": "yellow"},
+            "success": {"color": "white", "bold": True},
+            "error": {"color": "red"},
+            "critical": {"background": "red"},
+        },
+    )
+    _installed.add(logger.name)
@@ -0,0 +1,206 @@
+"""
+Long-running lookup service answering blacklist queries over HTTP.
+
+The index is read into memory once and shared by all requests. Background
+threads refresh feeds as they come due and reload the index when the file
+changes, swapping the new snapshot in with a single reference assignment,
+so lookups never wait on an update.
+
+    GET  /check?ip=1.2.3.4&ip=5.6.7.8
+    POST /check   {"ips": ["1.2.3.4", "5.6.7.8"]}
+    GET  /health
+"""
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from utils import batchmatch, records
+from utils.blindex import BlacklistIndex
+from utils.blworker import blklist
+from utils.scheduler import RefreshScheduler
+from utils.termcolors import Termcolor as Tc
+
+# max request body accepted, in bytes
+MAX_BODY = 16 * 1024 * 1024
+
+
+class Snapshot:
+    """ Immutable, in-memory copy of the blacklist index and scanner lists """
+
+    def __init__(self, index_path, scanners):
+        self.mtime = os.stat(index_path).st_mtime
+        self.index = BlacklistIndex(index_path, in_memory=True)
+        self.scanners = scanners
+        self.loaded = time.time()
+        self._matchers = None
+
+    def matchers(self):
+        """ Returns the batch matchers for the index and scanners, built on first use """
+        if self._matchers is None:
+            self._matchers = (
+                batchmatch.BatchMatcher.from_index(self.index),
+                batchmatch.BatchMatcher.from_feeds(self.scanners),
+            )
+        return self._matchers
+
+    def check(self, ip_addrs):
+        """ Returns a result dict for each IP, in request order """
+        return records.match_records(self.index, self.scanners, ip_addrs, self.matchers)
+
+
+class QueryService:
+    """ Holds the current snapshot and replaces it when the index is rebuilt """
+
+    def __init__(self, pbl, poll=60, update=True, tick=60):
+        self.pbl = pbl
+        self.poll = poll
+        self.update = update
+        self.tick = tick
+        self.snapshot = self.load()
+        self._stop = threading.Event()
+
+    def load(self):
+        return Snapshot(blklist, self.pbl.read_scanners())
+
+    def check(self, ip_addrs):
+        # take one reference, so a request is answered from a single snapshot even during a swap
+        return self.snapshot.check(ip_addrs)
+
+    def health(self):
+        snapshot = self.snapshot
+        return {
+            "feeds": len(snapshot.index.feeds),
+            "loaded": snapshot.loaded,
+            "index_modified": snapshot.mtime,
+        }
+
+    def reload(self):
+        """ Loads a new snapshot and swaps it in, keeping the current one if the index cannot be read """
+        try:
+            snapshot = self.load()
+        except (OSError, ValueError) as err:
+            print(f"{Tc.error} Index reload failed, keeping the loaded index: {err}", file=sys.stderr)
+            return False
+        self.snapshot = snapshot
+        print(f"{Tc.success} Index reloaded ({len(snapshot.index.feeds)} feeds)", file=sys.stderr)
+        return True
+
+    def refresh_loop(self):
+        """ Reloads the index when the file is replaced, e.g. by a refresh in another process """
+        while not self._stop.wait(self.poll):
+            try:
+                mtime = os.stat(blklist).st_mtime
+            except OSError:
+                continue
+            if mtime != self.snapshot.mtime:
+                self.reload()
+
+    def stop(self):
+        self._stop.set()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server_version = "BlacklistCheck"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            self.send_json(200, self.server.service.health())
+        elif url.path == "/check":
+            ips = parse_qs(url.query).get("ip", [])
+            self.send_json(200, {"results": self.server.service.check(ips)})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/check":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {"error": "invalid content length"})
+            return
+        if length > MAX_BODY:
+            self.send_json(413, {"error": "request too large"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            self.send_json(400, {"error": "invalid json"})
+            return
+
+        # accept {"ips": [...]} or a bare list
+        ips = body.get("ips") if isinstance(body, dict) else body
+        if not isinstance(ips, list):
+            self.send_json(400, {"error": "expected a list of ips"})
+            return
+        self.send_json(200, {"results": self.server.service.check(ips)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects an (address, port) pair
+        return request, ("local", 0)
+
+
+def remove_socket(path):
+    """ Removes a unix socket left by an earlier server, refusing to delete any other file """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        sys.exit(f"{Tc.error} {path} exists and is not a unix socket, not replacing it")
+    os.remove(path)
+
+
+def serve(service, address):
+    """ Serves lookups on 'host:port' or on a unix socket path until interrupted """
+    if ":" in address and not address.startswith(("/", ".")):
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), QueryHandler)
+    else:
+        remove_socket(address)
+        server = UnixHTTPServer(address, QueryHandler)
+    server.service = service
+
+    watcher = threading.Thread(target=service.refresh_loop, daemon=True)
+    watcher.start()
+    scheduler = RefreshScheduler(service.pbl, tick=service.tick, on_refresh=service.reload)
+    if service.update:
+        scheduler.start()
+    print(f"{Tc.processing} Serving lookups on {address} ({len(service.snapshot.index.feeds)} feeds loaded)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        scheduler.stop()
+        server.server_close()
+        if isinstance(server, UnixHTTPServer):
+            remove_socket(address)
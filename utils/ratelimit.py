@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+from utils.atomicfile import atomic_open
+
+# default (requests per minute, requests per day) of the free provider plans, 0 = no limit
+DEFAULT_LIMITS = {"virustotal": (4, 500), "abuseipdb": (0, 1000)}
+
+
+class TokenBucket:
+    """ Thread-safe token bucket allowing `capacity` requests per `period` seconds """
+
+    def __init__(self, capacity, period, tokens=None, updated=None):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self.updated = updated or time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """ Returns the seconds until a token is available """
+        with self._lock:
+            self._refill(time.time())
+            return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """ Blocks until a token is available and takes it """
+        while True:
+            with self._lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class Quota:
+    """ Per-provider request quota made of several token buckets (e.g. per minute and per day)
+
+    Bucket levels are persisted to `path` so a resumed run does not spend quota
+    that an interrupted run already used.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.buckets = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        if path and path.exists():
+            try:
+                with open(path) as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError):
+                self._state = {}
+
+    def limit(self, provider, capacity, period):
+        """ Adds a limit of `capacity` requests per `period` seconds for provider """
+        if capacity <= 0:
+            return
+        key = f"{capacity}/{period}"
+        tokens, updated = self._state.get(provider, {}).get(key, (None, None))
+        self.buckets.setdefault(provider, {})[key] = TokenBucket(capacity, period, tokens, updated)
+
+    def acquire(self, provider):
+        """ Blocks until every limit of provider allows another request """
+        buckets = self.buckets.get(provider, {}).values()
+        # wait on the slowest bucket first, so faster buckets are not drained while waiting
+        for bucket in sorted(buckets, key=lambda b: -b.wait_time()):
+            bucket.acquire()
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = dict(self._state)
+            for provider, buckets in self.buckets.items():
+                state[provider] = {key: (bucket.tokens, bucket.updated) for key, bucket in buckets.items()}
+            with atomic_open(self.path) as f:
+                json.dump(state, f)
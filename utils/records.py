@@ -0,0 +1,128 @@
+"""
+Structured check results, and writers streaming them as NDJSON or CSV.
+
+Each checked IP produces one record dict, with the fields of the checks that ran:
+
+    ip, listed, blacklists, scanners    blacklist and scanner matches (ip, error for invalid input)
+    location, whois, contacts           ip enrichment
+    dnsbl                               {zone: return code} of the listing RBLs
+    ip46, urlhaus                       single-ip intel checks
+    virustotal, abuseipdb               provider reports
+    history                             feed entries that listed the ip, with first and last seen times
+"""
+import csv
+import json
+
+from utils import batchmatch, blindex
+
+FIELDS = (
+    "ip",
+    "listed",
+    "blacklists",
+    "scanners",
+    "location",
+    "whois",
+    "contacts",
+    "dnsbl",
+    "ip46",
+    "urlhaus",
+    "virustotal",
+    "abuseipdb",
+    "history",
+    "error",
+)
+
+
+def match_records(index, scanners, ip_addrs, matchers=None, prefilter=None):
+    """ Returns a match record for each IP, in input order
+
+    Large batches use the batch matchers returned by `matchers()` when NumPy is
+    available, by default built from the index and scanners on each call. With a
+    prefilter (see utils.bloom), large batches skip the lookups of IPs it rejects.
+    """
+    records = []
+    queries = []
+    for ip in ip_addrs:
+        value = blindex.ip_to_int(ip) if isinstance(ip, str) else None
+        if value is None:
+            records.append({"ip": ip, "error": "invalid ip"})
+        else:
+            record = {"ip": ip, "listed": False, "blacklists": [], "scanners": []}
+            records.append(record)
+            queries.append((record, value))
+
+    values = [value for _, value in queries]
+    if prefilter is not None and len(queries) >= batchmatch.BATCH_THRESHOLD and batchmatch.available():
+        # rejected IPs keep their empty, unlisted record
+        maybe = prefilter.contains_many(values)
+        queries = [query for query, hit in zip(queries, maybe) if hit]
+        values = [value for _, value in queries]
+
+    if len(queries) >= batchmatch.BATCH_THRESHOLD and batchmatch.available():
+        if matchers is None:
+            index_matcher = batchmatch.BatchMatcher.from_index(index)
+            scanner_matcher = batchmatch.BatchMatcher.from_feeds(scanners)
+        else:
+            index_matcher, scanner_matcher = matchers()
+        for row, name in index_matcher.matches(values):
+            queries[row][0]["blacklists"].append(name)
+        for row, name in scanner_matcher.matches(values):
+            queries[row][0]["scanners"].append(name)
+    else:
+        for record, value in queries:
+            record["blacklists"] = index.lookup(value)
+            record["scanners"] = [name for name, intervals in scanners.items() if blindex.covers(intervals, value)]
+
+    for record, _ in queries:
+        record["listed"] = bool(record["blacklists"] or record["scanners"])
+    return records
+
+
+class NdjsonWriter:
+    """ Writes one JSON object per line """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._encode = json.JSONEncoder(separators=(",", ":")).encode
+
+    def write(self, record):
+        self.stream.write(self._encode(record) + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CsvWriter:
+    """ Writes a header and one row of FIELDS per record
+
+    Lists of plain values are joined with ";", dicts and lists of them are written as JSON.
+    """
+
+    def __init__(self, stream, fields=FIELDS):
+        self.stream = stream
+        self._writer = csv.DictWriter(stream, fields, extrasaction="ignore")
+        self._writer.writeheader()
+
+    @staticmethod
+    def cell(value):
+        if isinstance(value, (list, tuple)) and not any(isinstance(item, (dict, list, tuple)) for item in value):
+            return ";".join(map(str, value))
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, separators=(",", ":"))
+        if isinstance(value, bool):
+            return str(value).lower()
+        return value
+
+    def write(self, record):
+        self._writer.writerow({field: self.cell(value) for field, value in record.items()})
+
+    def flush(self):
+        self.stream.flush()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "csv": CsvWriter}
+
+
+def writer(fmt, stream):
+    """ Returns the record writer for an output format """
+    return WRITERS[fmt](stream)
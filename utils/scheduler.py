@@ -0,0 +1,44 @@
+import sys
+import threading
+
+from utils.termcolors import Termcolor as Tc
+
+
+class RefreshScheduler:
+    """ Refreshes each feed when its interval has passed, checking every `tick` seconds
+
+    Only due feeds are downloaded, and the rebuilt index is renamed into place,
+    so readers keep using a complete index while a refresh runs.
+    """
+
+    def __init__(self, pbl, tick=60, on_refresh=None):
+        self.pbl = pbl
+        self.tick = tick
+        self.on_refresh = on_refresh
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """ Refreshes the due feeds, returns their names """
+        try:
+            refreshed = self.pbl.refresh_due()
+        except Exception as err:
+            print(f"{Tc.error} Feed refresh failed: {err}", file=sys.stderr)
+            return []
+        if refreshed and self.on_refresh:
+            self.on_refresh()
+        return refreshed
+
+    def run(self):
+        """ Refreshes due feeds until stopped """
+        self.run_once()
+        while not self._stop.wait(self.tick):
+            self.run_once()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -1,9 +1,7 @@
-from colorama import Fore, init
+from colorama import Fore
 
 
 class Termcolor:
-    init(autoreset=True)
-
     # =colors
     bold = Fore.LIGHTWHITE_EX
     blue = Fore.LIGHTBLUE_EX
@@ -33,5 +31,5 @@ class Termcolor:
     # feeds
     chk_feeds = f"{green}Checking if feeds are current..."
     missing = f"\n{warning} Blacklist file missing -- use the '-u' option to download.\n{yellow}  Run: python blacklist_downloader.py -u"
-    outdated = f"{warning}{yellow} Blacklist file is older than 1 day - - use the '-u' option to update.\n"
+    outdated = f"{warning}{yellow} Some feeds are past their refresh interval - use the '-u' option to update.\n"
     current = f"\n{bold}All feeds are current. Use -fu to Force an Update"
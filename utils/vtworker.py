@@ -1,39 +1,46 @@
-import json
-import sys
 from http.client import responses
 
-import requests
 from requests.exceptions import (ConnectionError, HTTPError, RequestException,
                                  Timeout)
 
+from utils.errors import ApiKeyError
+from utils.intelclient import IntelClient
 from utils.termcolors import Termcolor as Tc
 
 
 class VirusTotal:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, intel=None):
         self.api_key = api_key
+        self.intel = intel or IntelClient()
         self.base_url = f"https://www.virustotal.com/vtapi/v2/ip-address/report?apikey="
-        if self.api_key is None:
-            sys.exit(f"{Tc.yellow}* Verify that you have provided your API key{Tc.rst}")
+        if not self.api_key:
+            raise ApiKeyError("Verify that you have provided your VirusTotal API key")
 
     # ---[ VirusTotal Connection ]---
-    @staticmethod
-    def vt_connect(url):
+    def vt_base(self, ip):
+        """ Returns the raw report response, or None if the request failed """
+        url = f"{self.base_url}{self.api_key}&ip={ip}"
         try:
-            resp = requests.get(url, timeout=5)
+            return self.intel.get("virustotal", url, timeout=5)
+        except (ConnectionError, HTTPError, RequestException, Timeout):
+            return None
+
+    def vt_connect(self, ip):
+        resp = self.vt_base(ip)
+        if resp is None:
+            print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{Tc.rst}")
+        else:
             if resp.status_code == 401:
-                sys.exit("[error] Invalid API key.")
+                raise ApiKeyError("Invalid VirusTotal API key.")
             if resp.status_code != 200:
-                print(f" {Tc.error} {Tc.gray} {resp.status_code} {responses[resp.status_code]}{url}{Tc.rst}")
+                print(f" {Tc.error} {Tc.gray} {resp.status_code} {responses[resp.status_code]}{Tc.rst}")
             else:
                 return resp.json()
-        except (ConnectionError, HTTPError, RequestException, Timeout):
-            print(f"    {Tc.error}{Tc.dl_error} {Tc.gray}{Tc.rst}")
 
     def vt_run(self, ip):
-        url = f"{self.base_url}{self.api_key}&ip={''.join(ip)}"
-        data = json.dumps(self.vt_connect(url))
-        json_resp = json.loads(data)
+        json_resp = self.vt_connect(ip)
+        if json_resp is None:
+            return
         if json_resp["response_code"] == 1:
             try:
                 if json_resp["resolutions"]:
@@ -56,3 +63,48 @@ class VirusTotal:
                 pass
         elif json_resp["response_code"] == 0:
             print(Tc.clean)
+
+    # ---[ VirusTotal Batch ]---
+    def vt_report(self, ip):
+        """ Returns the report for ip, or None if it could not be fetched """
+        resp = self.vt_base(ip)
+        if resp is None:
+            return None
+        if resp.status_code == 401:
+            raise ApiKeyError("Invalid VirusTotal API key.")
+        if resp.status_code == 200:
+            return resp.json()
+
+    @staticmethod
+    def vt_record(report):
+        """ Returns the detection counts of a report, or None for a failed lookup """
+        if report is None:
+            return None
+        if report.get("response_code") != 1:
+            return {"urls": 0, "hashes": 0, "hostnames": 0}
+        return {
+            field: len(report.get(key) or [])
+            for field, key in (("urls", "detected_urls"), ("hashes", "detected_downloaded_samples"), ("hostnames", "resolutions"))
+        }
+
+    @staticmethod
+    def vt_summary(report):
+        if report.get("response_code") != 1:
+            return Tc.clean
+        counts = VirusTotal.vt_record(report)
+        return ", ".join(f"{label}: {counts[label.lower()]}" for label in ("URLs", "Hashes", "Hostnames"))
+
+    def vt_cached(self, ip, cache, quota):
+        """ Returns the cached report for ip, fetching it at the pace quota allows, or None if it could not be fetched """
+
+        def fetch(ip):
+            quota.acquire("virustotal")
+            return self.vt_report(ip)
+
+        return cache.get_or_fetch("virustotal", ip, fetch)
+
+    def vt_batch(self, ips, cache, quota):
+        """ Yields (ip, summary) for each ip, fetching uncached reports at the pace quota allows """
+        for ip in ips:
+            report = self.vt_cached(ip, cache, quota)
+            yield ip, None if report is None else self.vt_summary(report)
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+
+# consecutive runs in which every query to a zone failed before it is skipped
+DEAD_AFTER = 3
+# seconds before a skipped zone is probed again
+RETRY_AFTER = 1800
+# share of a run's zones failing together that points at the resolver, not the zones
+OUTAGE_SHARE = 0.9
+# smoothing factor for the latency average
+ALPHA = 0.3
+
+
+class ZoneHealth:
+    """ Per-zone latency, timeout and error tracking for the DNSBL engine, persisted across runs """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.zones = {}
+        self._conn = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS zones (zone TEXT PRIMARY KEY, queries INTEGER, timeouts INTEGER, "
+            "errors INTEGER, latency REAL, failures INTEGER, last_ok REAL, last_check REAL)"
+        )
+        for row in self._conn.execute("SELECT * FROM zones"):
+            self.zones[row[0]] = dict(
+                zip(("queries", "timeouts", "errors", "latency", "failures", "last_ok", "last_check"), row[1:])
+            )
+
+    def _zone(self, zone):
+        return self.zones.setdefault(
+            zone,
+            {"queries": 0, "timeouts": 0, "errors": 0, "latency": None, "failures": 0, "last_ok": None, "last_check": None},
+        )
+
+    def is_dead(self, zone, now=None):
+        """ Returns True if the zone keeps failing and is not yet due for another probe """
+        stats = self.zones.get(zone)
+        if not stats or stats["failures"] < DEAD_AFTER:
+            return False
+        return (now or time.time()) - (stats["last_check"] or 0) < RETRY_AFTER
+
+    def timeout(self, zone, default):
+        """ Returns a timeout scaled to the zone's usual latency, capped at the default """
+        stats = self.zones.get(zone)
+        if not stats or stats["latency"] is None:
+            return default
+        return min(default, max(0.5, stats["latency"] * 4))
+
+    def record_run(self, outcomes, now=None):
+        """ Records one DNSBL run from {zone: [latencies, timeouts, errors]}, returns False if discarded as an outage
+
+        A zone gains at most one failure per run, however many of its queries
+        failed. When nearly all zones fail together the resolver is down rather
+        than the zones, so the failures of that run are not recorded.
+        """
+        now = now or time.time()
+        failed = [zone for zone, (latencies, _, _) in outcomes.items() if not latencies]
+        if len(outcomes) > 1 and len(failed) >= OUTAGE_SHARE * len(outcomes):
+            return False
+
+        with self._lock:
+            for zone, (latencies, timeouts, errors) in outcomes.items():
+                stats = self._zone(zone)
+                stats["queries"] += len(latencies) + timeouts + errors
+                stats["timeouts"] += timeouts
+                stats["errors"] += errors
+                stats["last_check"] = now
+                if not latencies:
+                    stats["failures"] += 1
+                    continue
+                stats["failures"] = 0
+                stats["last_ok"] = now
+                for latency in latencies:
+                    prev = stats["latency"]
+                    stats["latency"] = latency if prev is None else ALPHA * latency + (1 - ALPHA) * prev
+        return True
+
+    def report(self):
+        """ Returns (zone, stats) for every zone with failures, dead zones first """
+        failing = [(zone, stats) for zone, stats in self.zones.items() if stats["timeouts"] or stats["errors"]]
+        return sorted(failing, key=lambda item: (-item[1]["failures"], item[0]))
+
+    def save(self):
+        if self._conn is None:
+            return
+        with self._lock:
+            rows = [
+                (zone, *(stats[key] for key in ("queries", "timeouts", "errors", "latency", "failures", "last_ok", "last_check")))
+                for zone, stats in self.zones.items()
+            ]
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO zones VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None